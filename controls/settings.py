@@ -43,6 +43,17 @@ INSTALLED_APPS = [
     'controlsAPI',
 ]
 
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'controlsAPI.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Responses smaller than this are not compressed. Brotli (in requirements.txt) is preferred over gzip;
+# without the brotli package installed only gzip is offered.
+CONTROLS_API_COMPRESSION_MIN_BYTES = 1024
+
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
         'Basic': {
@@ -53,6 +64,7 @@ SWAGGER_SETTINGS = {
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'controlsAPI.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -105,6 +117,41 @@ DATABASES = {
 
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Read-through cache of the *_details responses. Invalidation goes through version numbers in
+    # the database, so every worker sees every write; the local-memory store keeps entries per
+    # process, to share the entries themselves between workers switch to the file-backed store:
+    #     'BACKEND': 'controlsAPI.cache.LRUFileCache',
+    #     'LOCATION': BASE_DIR / 'cache',
+    'controls_api': {
+        'BACKEND': 'controlsAPI.cache.LRUMemoryCache',
+        'LOCATION': 'controls-api',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_BYTES': 64 * 1024 * 1024,
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
+CONTROLS_API_CACHE = 'controls_api'
+
+# Read backend of the hot details lookups: 'orm' goes through djongo, 'mongo' opts in to querying
+# the collections behind the models with pymongo. Databases other than djongo always use the ORM.
+CONTROLS_API_READ_BACKEND = 'orm'
+
+# File written by `manage.py build_catalog_snapshot` and served by catalog_snapshot/ while no change
+# was logged after it. With a delay in seconds, committed writes also rebuild it in the background.
+CONTROLS_API_SNAPSHOT_PATH = BASE_DIR / 'catalog.snapshot'
+CONTROLS_API_SNAPSHOT_REBUILD_DELAY = None
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ControlsapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'controlsAPI'
+
+    def ready(self):
+        from . import cache, changelog, closure, effective, repository, search, snapshot  # noqa: F401  registers the index signal receivers
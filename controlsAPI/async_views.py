@@ -0,0 +1,137 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from .models import Control, ControlHierarchy, ControlSet, ControlSetReference, prefetch_edges
+from .pagination import ControlHierarchyPagination, ControlPagination, ControlSetPagination, ControlSetReferencePagination
+from .resolvers import resolve_hierarchies
+from .serializers import ControlHierarchyModelSerializer, ControlModelSerializer, ControlsetModelSerializer, ControlsetReferenceModelSerializer
+
+# Upper bound on ORM calls running at the same time for all async views of this process.
+ASYNC_QUERY_CONCURRENCY = 16
+
+_query_executor = ThreadPoolExecutor(max_workers=ASYNC_QUERY_CONCURRENCY, thread_name_prefix='controlsapi-query')
+
+
+# Pool threads keep their own database connections, and Django only closes connections that are
+# broken or past CONN_MAX_AGE in the request thread, so every call checks them itself.
+def _with_connection_checks(function, *args):
+    close_old_connections()
+    try:
+        return function(*args)
+    finally:
+        close_old_connections()
+
+
+# Run a blocking ORM call on the query pool instead of the single thread Django uses for sync code,
+# so the calls of concurrent requests overlap.
+async def run_query(function, *args):
+    return await sync_to_async(_with_connection_checks, thread_sensitive=False, executor=_query_executor)(function, *args)
+
+
+def render(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(JSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+def _paginate(paginator_class, serializer_class, queryset, request):
+    paginator = paginator_class()
+    page = paginator.paginate_queryset(queryset, Request(request))
+    return paginator.get_paginated_response(serializer_class(page, many=True).data).data
+
+
+def _serialize_by_name(model, serializer_class, name):
+    try:
+        return serializer_class(model.objects.get(name=name)).data
+    except model.DoesNotExist:
+        return None
+
+
+# Shared GET handler of the plain details endpoints: one object by name, or one page of all objects.
+async def _details(request, model, serializer_class, paginator_class):
+    name = request.GET.get("name")
+    try:
+        if name:
+            data = await run_query(_serialize_by_name, model, serializer_class, name)
+            if data is None:
+                return render({"msg": f"No object found with name {name}"}, status.HTTP_404_NOT_FOUND)
+            return render(data)
+        return render(await run_query(_paginate, paginator_class, serializer_class, model.objects.all(), request))
+    except APIException as exc:
+        return render({"detail": exc.detail}, exc.status_code)
+
+
+class AsyncControlDetailsView(View):
+    async def get(self, request):
+        return await _details(request, Control, ControlModelSerializer, ControlPagination)
+
+
+class AsyncControlsetRefDetailsView(View):
+    async def get(self, request):
+        return await _details(request, ControlSetReference, ControlsetReferenceModelSerializer, ControlSetReferencePagination)
+
+
+class AsyncControlSetDetailsView(View):
+    async def get(self, request):
+        return await _details(request, ControlSet, ControlsetModelSerializer, ControlSetPagination)
+
+
+def _load_page(request):
+    paginator = ControlHierarchyPagination()
+    page = paginator.paginate_queryset(ControlHierarchy.objects.prefetch_related('control_set'), Request(request))
+    return paginator, page
+
+
+def _load_hierarchy(slug):
+    return ControlHierarchy.objects.prefetch_related('control_set').filter(slug=slug).first()
+
+
+def _serialize_hierarchies(hierarchies, fields):
+    return ControlHierarchyModelSerializer(hierarchies, many=True, fields=fields).data
+
+
+# Same output as fieldsets.hierarchy_data(). The references come prefetched with the hierarchies,
+# so the edges, the control details of the references and the control set names are independent
+# lookups: they run at the same time on the query pool, which bounds them with every other request's.
+# Serializing only reads what is already loaded and stays on the event loop.
+async def _hierarchy_data(hierarchies):
+    data = _serialize_hierarchies(hierarchies, ['slug', 'control_set'])
+    await asyncio.gather(
+        run_query(prefetch_edges, hierarchies),
+        run_query(resolve_hierarchies, data, True, False),
+        run_query(resolve_hierarchies, data, False, True),
+    )
+    edges = _serialize_hierarchies(hierarchies, ['parents', 'children'])
+    return [
+        {'slug': item['slug'], 'control_set': item['control_set'], **edge_item, 'control_set_name': item['control_set_name']}
+        for item, edge_item in zip(data, edges)
+    ]
+
+
+# Async counterpart of AllControlHierarchiesDetailsAPI, built from the same serializer and resolvers.
+class AsyncControlHierarchiesDetailsView(View):
+    async def get(self, request):
+        name = request.GET.get("name")
+        try:
+            if name:
+                return await self.get_by_name(name)
+            paginator, page = await run_query(_load_page, request)
+        except APIException as exc:
+            return render({"detail": exc.detail}, exc.status_code)
+        data = await _hierarchy_data(page)
+        return render(paginator.get_paginated_response(data).data)
+
+    async def get_by_name(self, name):
+        control_set = await run_query(ControlSet.objects.filter(name=name).first)
+        if control_set is None:
+            return render({"msg": f"No Control Set found with name {name}"}, status.HTTP_404_NOT_FOUND)
+        hierarchy = await run_query(_load_hierarchy, control_set.slug)
+        if hierarchy is None:
+            return render({"msg": f"No ControlHierarchy found with slug {control_set.slug}"}, status.HTTP_404_NOT_FOUND)
+        data = await _hierarchy_data([hierarchy])
+        return render(data[0])
@@ -0,0 +1,86 @@
+import json
+from django.db import DatabaseError, connection, transaction
+from django.test import RequestFactory
+from django.urls import Resolver404, resolve
+from rest_framework.views import APIView
+from .repository import shared_lookups
+
+BATCH_MAX_OPERATIONS = 100
+BATCH_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class BatchError(Exception):
+    pass
+
+
+# Check every operation before anything runs, so a malformed batch never writes.
+def validate_operations(operations):
+    if not isinstance(operations, list) or not operations:
+        raise BatchError("Expected a non-empty list of operations")
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        raise BatchError(f"A batch holds at most {BATCH_MAX_OPERATIONS} operations")
+    views = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise BatchError(f"Operation {index} must be an object with method, path and body")
+        method = str(operation.get("method", "")).upper()
+        if method not in BATCH_METHODS:
+            raise BatchError(f"Operation {index} has an unsupported method {operation.get('method')}")
+        path = operation.get("path")
+        if not isinstance(path, str):
+            raise BatchError(f"Operation {index} needs a path")
+        try:
+            match = resolve('/' + path.lstrip('/').split('?')[0], urlconf='controlsAPI.urls')
+        except Resolver404:
+            raise BatchError(f"Operation {index} targets an unknown path {path}")
+        view_class = getattr(match.func, 'view_class', None)
+        if view_class is None or not issubclass(view_class, APIView) or getattr(view_class, 'batchable', True) is False:
+            raise BatchError(f"Operation {index} targets {path}, which cannot run inside a batch")
+        views.append((method, path, match.func))
+    return views
+
+
+# GET operations send their body as query parameters, the others as a JSON request body.
+def _operation_request(request, method, path, body):
+    factory = RequestFactory(HTTP_HOST=request.get_host(), **{'wsgi.url_scheme': request.scheme})
+    path = '/' + path.lstrip('/')
+    if method == 'GET':
+        return factory.get(path, body or {})
+    return getattr(factory, method.lower())(path, json.dumps(body if body is not None else {}), content_type='application/json')
+
+
+def _run_operations(request, operations, views, results):
+    for index, (operation, (method, path, view)) in enumerate(zip(operations, views)):
+        response = view(_operation_request(request, method, path, operation.get("body")))
+        results.append({"index": index, "status": response.status_code, "body": getattr(response, 'data', None)})
+        if response.status_code >= 400:
+            return False
+    return True
+
+
+# Run the operations in order, sharing repository lookups between them, and stop at the first one
+# answering with a 4xx/5xx status. On a database with transactions they run in one transaction that
+# the failure rolls back. Without transactions (djongo) set_rollback() would undo nothing while
+# discarding the on_commit work (cache versions, indexes, snapshot rebuild) of the writes that stay,
+# so each operation commits on its own and the summary reports how many of them were applied.
+def run_batch(request, operations):
+    views = validate_operations(operations)
+    results = []
+    atomic = connection.features.supports_transactions
+    with shared_lookups():
+        if atomic:
+            with transaction.atomic():
+                committed = _run_operations(request, operations, views, results)
+                if not committed:
+                    transaction.set_rollback(True)
+        else:
+            try:
+                committed = _run_operations(request, operations, views, results)
+            except DatabaseError:
+                results.append({"index": len(results), "status": 500, "body": {"error": "Database error"}})
+                committed = False
+    if committed:
+        applied = len(results)
+    else:
+        applied = 0 if atomic else len(results) - 1
+    return {"atomic": atomic, "committed": committed, "applied": applied, "results": results}
@@ -0,0 +1,63 @@
+from django.db import transaction
+from .models import Control, ControlHierarchy, ControlSet, ControlSetReference
+from .serializers import ControlModelSerializer, ControlsetModelSerializer
+from .signals import bulk_created
+
+BULK_BATCH_SIZE = 1000
+
+
+# Validate every item with a many=True serializer and drop the ones whose unique field is taken,
+# either in the database or by an earlier item of the same request. Returns (valid items, errors by index).
+def _validate(serializer_class, model, field, items):
+    serializer = serializer_class(data=items, many=True)
+    errors = {}
+    indices = list(range(len(items)))
+    if not serializer.is_valid():
+        errors = {index: item_errors for index, item_errors in enumerate(serializer.errors) if item_errors}
+        indices = [index for index in indices if index not in errors]
+        serializer = serializer_class(data=[items[index] for index in indices], many=True)
+        serializer.is_valid(raise_exception=True)
+    validated = list(zip(indices, serializer.validated_data))
+    existing = set(model.objects.filter(**{field + '__in': [data[field] for index, data in validated]}).values_list(field, flat=True))
+    seen = set()
+    valid = []
+    for index, data in validated:
+        if data[field] in existing or data[field] in seen:
+            errors[index] = {field: [f"{model.__name__} with this {field} already exists."]}
+            continue
+        seen.add(data[field])
+        valid.append((index, data))
+    return valid, errors
+
+
+def _report(created, errors):
+    return {
+        "created": created,
+        "errors": [{"index": index, "errors": item_errors} for index, item_errors in sorted(errors.items())]
+    }
+
+
+# Create Controls and their ControlSetReferences in two bulk inserts instead of two inserts per Control.
+def bulk_create_controls(items, batch_size=BULK_BATCH_SIZE):
+    valid, errors = _validate(ControlModelSerializer, Control, 'name', items)
+    controls = [Control(name=item['name'], description=item['description']) for index, item in valid]
+    references = [ControlSetReference(name=control.name) for control in controls]
+    with transaction.atomic():
+        Control.objects.bulk_create(controls, batch_size=batch_size)
+        ControlSetReference.objects.bulk_create(references, batch_size=batch_size)
+        bulk_created.send(sender=Control, instances=controls)
+        bulk_created.send(sender=ControlSetReference, instances=references)
+    return _report(ControlModelSerializer(controls, many=True).data, errors)
+
+
+# Create ControlSets and their ControlHierarchies in two bulk inserts instead of two inserts per ControlSet.
+def bulk_create_control_sets(items, batch_size=BULK_BATCH_SIZE):
+    valid, errors = _validate(ControlsetModelSerializer, ControlSet, 'name', items)
+    control_sets = [ControlSet(name=item['name'], hierarchy_depth=item['hierarchy_depth']) for index, item in valid]
+    hierarchies = [ControlHierarchy(slug=control_set.slug) for control_set in control_sets]
+    with transaction.atomic():
+        ControlSet.objects.bulk_create(control_sets, batch_size=batch_size)
+        ControlHierarchy.objects.bulk_create(hierarchies, batch_size=batch_size)
+        bulk_created.send(sender=ControlSet, instances=control_sets)
+        bulk_created.send(sender=ControlHierarchy, instances=hierarchies)
+    return _report(ControlsetModelSerializer(control_sets, many=True).data, errors)
@@ -0,0 +1,209 @@
+import hashlib
+import os
+import threading
+from collections import defaultdict
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from rest_framework import status
+from rest_framework.response import Response
+from .models import CollectionVersion, Control, ControlHierarchy, ControlSet, ControlSetReference, HierarchyEdge
+from .signals import bulk_changed, bulk_created, edges_changed
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+_MISSING = object()
+_usages = {}
+
+
+# Local-memory cache that evicts least recently used entries once their pickled size exceeds OPTIONS['MAX_BYTES'].
+class LRUMemoryCache(LocMemCache):
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self._max_bytes = params.get('OPTIONS', {}).get('MAX_BYTES', DEFAULT_MAX_BYTES)
+        self._usage = _usages.setdefault(name, {'bytes': 0, 'sizes': {}})
+
+    def _set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self._delete(key)
+        # LocMemCache keeps the most recently used entry first, so the oldest one is at the end.
+        while self._cache and self._usage['bytes'] + len(value) > self._max_bytes:
+            self._delete(next(reversed(self._cache)))
+        super()._set(key, value, timeout)
+        self._usage['sizes'][key] = len(value)
+        self._usage['bytes'] += len(value)
+
+    def _cull(self):
+        count = len(self._cache) // self._cull_frequency if self._cull_frequency else len(self._cache)
+        for key in list(reversed(self._cache))[:count]:
+            self._delete(key)
+
+    def _delete(self, key):
+        self._usage['bytes'] -= self._usage['sizes'].pop(key, 0)
+        return super()._delete(key)
+
+    # LocMemCache.clear() takes the same non-reentrant lock, so the entries are dropped here directly.
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._expire_info.clear()
+            self._usage['bytes'] = 0
+            self._usage['sizes'].clear()
+
+
+# File-backed cache shared by every worker process. Reads refresh the file's mtime, and writes evict the
+# least recently used files once the directory grows past OPTIONS['MAX_BYTES'].
+class LRUFileCache(FileBasedCache):
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._max_bytes = params.get('OPTIONS', {}).get('MAX_BYTES', DEFAULT_MAX_BYTES)
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        if value is _MISSING:
+            return default
+        try:
+            os.utime(self._key_to_file(key, version))
+        except FileNotFoundError:
+            pass
+        return value
+
+    def _cull(self):
+        entries = []
+        for path in self._list_cache_files():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for mtime, size, path in entries)
+        count = len(entries)
+        for mtime, size, path in sorted(entries):
+            if total < self._max_bytes and count < self._max_entries:
+                break
+            if self._delete(path):
+                total -= size
+                count -= 1
+
+
+def response_cache():
+    return caches[getattr(settings, 'CONTROLS_API_CACHE', 'default')]
+
+
+# Every model collection has a version number in the CollectionVersion table, shared by all worker
+# processes. Writes increment it in the same transaction, with one atomic update, so it only ever
+# grows and a rolled back write leaves it unchanged. Cache keys and ETags include the versions of
+# the collections an endpoint reads, so bumping one retires exactly those entries everywhere.
+def collection_name(model):
+    if model is ControlHierarchy.control_set.through:
+        model = ControlHierarchy
+    return model._meta.model_name
+
+
+def versions(collections):
+    collections = list(collections)
+    stored = dict(CollectionVersion.objects.filter(collection__in=collections).values_list('collection', 'version'))
+    return {collection: stored.get(collection, 0) for collection in collections}
+
+
+# djongo cannot translate F() updates, so MongoDB gets an upserting $inc instead.
+def bump_versions(*collections):
+    if connection.vendor == 'djongo':
+        connection.ensure_connection()
+        table = connection.connection[CollectionVersion._meta.db_table]
+        for collection in collections:
+            table.update_one({'collection': collection}, {'$inc': {'version': 1}}, upsert=True)
+        return
+    for collection in collections:
+        if CollectionVersion.objects.filter(collection=collection).update(version=F('version') + 1):
+            continue
+        try:
+            with transaction.atomic():
+                CollectionVersion.objects.create(collection=collection, version=1)
+        except IntegrityError:
+            CollectionVersion.objects.filter(collection=collection).update(version=F('version') + 1)
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(lambda: {'hits': 0, 'misses': 0, 'not_modified': 0})
+
+    def record(self, endpoint, outcome):
+        with self._lock:
+            self.counters[endpoint][outcome] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: dict(counters) for endpoint, counters in self.counters.items()}
+
+
+cache_stats = CacheStats()
+
+
+# Digest of the endpoint, the full request URL and the versions of every collection it reads. Equal
+# digests mean an identical response body, so it serves both as the cache key and as a strong ETag.
+def response_version(endpoint, models, request):
+    collections = versions(sorted(collection_name(model) for model in models))
+    parts = [endpoint, request.build_absolute_uri()] + [f"{collection}={version}" for collection, version in sorted(collections.items())]
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+def _etag_matches(request, etag):
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    # If-None-Match uses the weak comparison, so a W/ prefix (added by compression) still matches.
+    candidates = {candidate.strip().removeprefix('W/') for candidate in if_none_match.split(',')}
+    return '*' in candidates or etag in candidates
+
+
+# Read-through cache for APIView GET handlers: successful responses are stored per endpoint and
+# full URL, and served again until one of the given models changes. Responses carry an ETag, and a
+# request whose If-None-Match still matches gets 304 without touching the database or serializers.
+def cached_response(endpoint, models):
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            # Inside a transaction (e.g. a /batch/ request) the versions may include writes that are rolled back.
+            if transaction.get_connection().in_atomic_block:
+                return handler(view, request, *args, **kwargs)
+            version = response_version(endpoint, models, request)
+            etag = f'"{version}"'
+            if _etag_matches(request, etag):
+                cache_stats.record(endpoint, 'not_modified')
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+            cache = response_cache()
+            key = "controlsapi:response:" + version
+            data = cache.get(key, _MISSING)
+            if data is not _MISSING:
+                cache_stats.record(endpoint, 'hits')
+                return Response(data, headers={'ETag': etag})
+            cache_stats.record(endpoint, 'misses')
+            response = handler(view, request, *args, **kwargs)
+            if response.status_code == 200 and getattr(response, 'data', None) is not None:
+                cache.set(key, response.data, timeout=None)
+                response['ETag'] = etag
+            return response
+        return wrapper
+    return decorator
+
+
+# m2m_changed is sent before and after the through rows change; only the post_ actions are writes.
+def _bump_sender_version(sender, action=None, **kwargs):
+    if action is not None and not action.startswith('post_'):
+        return
+    bump_versions(collection_name(sender))
+
+
+for model in (Control, ControlSet, ControlSetReference, ControlHierarchy, HierarchyEdge):
+    post_save.connect(_bump_sender_version, sender=model, dispatch_uid=f"controlsapi_cache_save_{model._meta.model_name}")
+    post_delete.connect(_bump_sender_version, sender=model, dispatch_uid=f"controlsapi_cache_delete_{model._meta.model_name}")
+m2m_changed.connect(_bump_sender_version, sender=ControlHierarchy.control_set.through, dispatch_uid="controlsapi_cache_m2m")
+bulk_created.connect(_bump_sender_version, dispatch_uid="controlsapi_cache_bulk_created")
+bulk_changed.connect(_bump_sender_version, dispatch_uid="controlsapi_cache_bulk_changed")
+edges_changed.connect(_bump_sender_version, dispatch_uid="controlsapi_cache_edges")
@@ -0,0 +1,30 @@
+from django.db import transaction
+from .models import Control, ControlHierarchy, ControlSetReference
+from .signals import bulk_changed
+
+
+# Everything deleting a Control touches: the ControlSetReference rows named after it and the
+# hierarchies that list them. Hierarchies only lose the references, they are never deleted.
+def control_cascade(name):
+    through = ControlHierarchy.control_set.through
+    references = list(ControlSetReference.objects.filter(name=name).values_list('name', flat=True))
+    hierarchies = []
+    if references:
+        hierarchies = sorted(set(through.objects.filter(controlsetreference_id__in=references).values_list('controlhierarchy_id', flat=True)))
+    return {"control": name, "references": references, "hierarchies": hierarchies}
+
+
+# Delete a Control with its references and their hierarchy links in one transaction: one filtered
+# delete per table. With dry_run the cascade is only computed and returned.
+def delete_control(name, dry_run=False):
+    cascade = control_cascade(name)
+    if dry_run:
+        return cascade
+    through = ControlHierarchy.control_set.through
+    with transaction.atomic():
+        if cascade["references"]:
+            through.objects.filter(controlsetreference_id__in=cascade["references"]).delete()
+            bulk_changed.send(sender=through, slugs=cascade["hierarchies"])
+            ControlSetReference.objects.filter(name__in=cascade["references"]).delete()
+        Control.objects.filter(name=name).delete()
+    return cascade
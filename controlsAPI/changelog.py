@@ -0,0 +1,178 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.db.models import Count, Max, Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from .fieldsets import hierarchy_data
+from .models import ChangeLogEntry, Control, ControlHierarchy, ControlSet, ControlSetReference, HierarchyEdge
+from .signals import bulk_changed, bulk_created, edges_changed
+
+CHANGES_PAGE_SIZE = 500
+CHANGES_MAX_PAGE_SIZE = 5000
+# Longest a transaction writing log entries is expected to stay open, see changes_since().
+CHANGES_GAP_TIMEOUT = timedelta(seconds=60)
+
+# Collection names used in the log and in changes/ responses. Controls and references are keyed by
+# name, control sets and hierarchies by slug.
+CONTROLS = 'control'
+REFERENCES = 'controlsetreference'
+CONTROL_SETS = 'controlset'
+HIERARCHIES = 'controlhierarchy'
+
+
+# Entries are written by the receivers below inside the transaction of the change itself, so a
+# rolled back change leaves no entry behind.
+def record_changes(collection, keys):
+    keys = sorted({str(key) for key in keys})
+    ChangeLogEntry.objects.bulk_create([ChangeLogEntry(collection=collection, key=key) for key in keys])
+
+
+def latest_sequence():
+    return ChangeLogEntry.objects.order_by('-sequence').values_list('sequence', flat=True).first() or 0
+
+
+# Sequence of the newest entry older than CHANGES_GAP_TIMEOUT, 0 without one. A missing sequence
+# below it is not going to be committed any more (see _before_open_gap).
+def settled_sequence():
+    horizon = timezone.now() - CHANGES_GAP_TIMEOUT
+    entries = ChangeLogEntry.objects.order_by('-sequence').values_list('sequence', 'changed_at')
+    for sequence, changed_at in entries.iterator(chunk_size=CHANGES_PAGE_SIZE):
+        if changed_at <= horizon:
+            return sequence
+    return 0
+
+
+# Number and highest sequence of the entries logged after since. Both stay the same only while
+# nothing is committed there, a late commit of a lower sequence included.
+def log_state(since):
+    state = ChangeLogEntry.objects.filter(sequence__gt=since).aggregate(count=Count('sequence'), latest=Max('sequence'))
+    return state['count'], state['latest'] or since
+
+
+def _hierarchy_slugs(names):
+    return ControlSet.objects.filter(name__in=list(names)).values_list('slug', flat=True)
+
+
+# Hierarchies whose resolved details show the given references: the ones listing them, and the
+# ones listing a reference whose control is found through the same reference_id. A Control is
+# resolved through the ControlSetReference of the same name, so Control names work here too.
+def _reference_hierarchy_slugs(names):
+    names = list(names)
+    reference_ids = ControlSetReference.objects.filter(name__in=names).exclude(reference_id=None).values('reference_id')
+    through = ControlHierarchy.control_set.through
+    return through.objects.filter(
+        Q(controlsetreference_id__in=names) | Q(controlsetreference__reference_id__in=reference_ids)
+    ).values_list('controlhierarchy_id', flat=True).distinct()
+
+
+def _record_objects(sender, keys):
+    keys = list(keys)
+    if sender is Control:
+        record_changes(CONTROLS, keys)
+        record_changes(HIERARCHIES, _reference_hierarchy_slugs(keys))
+    elif sender is ControlSetReference:
+        record_changes(REFERENCES, keys)
+        record_changes(HIERARCHIES, _reference_hierarchy_slugs(keys))
+    elif sender is ControlSet:
+        record_changes(CONTROL_SETS, keys)
+    elif sender is ControlHierarchy:
+        record_changes(HIERARCHIES, keys)
+
+
+@receiver(post_save, sender=Control)
+@receiver(post_save, sender=ControlSetReference)
+@receiver(post_save, sender=ControlSet)
+@receiver(post_save, sender=ControlHierarchy)
+@receiver(post_delete, sender=Control)
+@receiver(post_delete, sender=ControlSetReference)
+@receiver(post_delete, sender=ControlSet)
+@receiver(post_delete, sender=ControlHierarchy)
+def log_change(sender, instance, **kwargs):
+    _record_objects(sender, [instance.pk])
+
+
+# A deleted edge changes the parents or children of the hierarchies on both of its ends.
+@receiver(post_delete, sender=HierarchyEdge)
+def log_edge_delete(instance, **kwargs):
+    record_changes(HIERARCHIES, _hierarchy_slugs([instance.parent_id, instance.child_id]))
+
+
+@receiver(bulk_created)
+def log_bulk_created(sender, instances, **kwargs):
+    _record_objects(sender, [instance.pk for instance in instances])
+
+
+@receiver(bulk_changed)
+def log_bulk_changed(sender, slugs=None, names=None, **kwargs):
+    if sender is ControlHierarchy.control_set.through and slugs is not None:
+        record_changes(HIERARCHIES, slugs)
+    elif sender is ControlSetReference and names is not None:
+        _record_objects(sender, names)
+
+
+@receiver(m2m_changed, sender=ControlHierarchy.control_set.through)
+def log_membership_change(instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        record_changes(HIERARCHIES, [instance.slug])
+    elif pk_set:
+        record_changes(HIERARCHIES, pk_set)
+
+
+@receiver(edges_changed, sender=HierarchyEdge)
+def log_edges_change(added, removed, **kwargs):
+    names = {name for edge in list(added) + list(removed) for name in edge}
+    if names:
+        record_changes(HIERARCHIES, _hierarchy_slugs(names))
+
+
+def _current_objects(collection, keys):
+    if collection == CONTROLS:
+        return {control['name']: control for control in Control.objects.filter(name__in=keys).values('name', 'description')}
+    if collection == REFERENCES:
+        return {reference['name']: reference for reference in ControlSetReference.objects.filter(name__in=keys).values('name', 'reference_id')}
+    if collection == CONTROL_SETS:
+        return {control_set['slug']: control_set for control_set in ControlSet.objects.filter(slug__in=keys).values('slug', 'name', 'hierarchy_depth')}
+    hierarchies = list(ControlHierarchy.objects.prefetch_related('control_set').filter(slug__in=keys))
+    return {hierarchy['slug']: hierarchy for hierarchy in hierarchy_data(hierarchies)}
+
+
+# Sequences are handed out when an entry is inserted, not when its transaction commits, so a lower
+# sequence can become visible after a higher one. A missing sequence younger than
+# CHANGES_GAP_TIMEOUT may still be committed: the page stops before it, and next_since stays behind
+# it until it shows up or times out (a rolled back write leaves a gap that never fills).
+def _before_open_gap(since, entries):
+    horizon = timezone.now() - CHANGES_GAP_TIMEOUT
+    previous = since
+    for position, (sequence, collection, key, changed_at) in enumerate(entries):
+        if sequence != previous + 1 and changed_at > horizon:
+            return entries[:position]
+        previous = sequence
+    return entries
+
+
+# Changes after sequence since, at most limit log entries of them. Several entries for one object
+# collapse into its current state: an upsert shaped like the details endpoints' output, or a
+# tombstone with just the key when the object no longer exists.
+def changes_since(since, limit=CHANGES_PAGE_SIZE):
+    entries = list(ChangeLogEntry.objects.filter(sequence__gt=since).order_by('sequence').values_list('sequence', 'collection', 'key', 'changed_at')[:limit + 1])
+    page = _before_open_gap(since, entries[:limit])
+    has_more = len(entries) > limit and len(page) == limit
+    entries = page
+    keys = defaultdict(dict)
+    for sequence, collection, key, changed_at in entries:
+        keys[collection][key] = None
+    upserts, tombstones = {}, {}
+    for collection, collection_keys in keys.items():
+        current = _current_objects(collection, list(collection_keys))
+        upserts[collection] = [current[key] for key in collection_keys if key in current]
+        tombstones[collection] = [key for key in collection_keys if key not in current]
+    return {
+        "since": since,
+        "next_since": entries[-1][0] if entries else since,
+        "has_more": has_more,
+        "upserts": upserts,
+        "tombstones": tombstones,
+    }
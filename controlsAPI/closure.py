@@ -0,0 +1,139 @@
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import ControlHierarchy, ControlSet, HierarchyClosure, HierarchyEdge
+from .signals import bulk_changed, edges_changed
+
+CLOSURE_BATCH_SIZE = 1000
+
+
+# Map hierarchy slugs to the slugs of their parents. With slugs=None every ControlSet is loaded.
+def _parent_slugs(slugs=None):
+    control_sets = ControlSet.objects.all() if slugs is None else ControlSet.objects.filter(slug__in=slugs)
+    child_slugs = {name: str(slug) for slug, name in control_sets.values_list('slug', 'name')}
+    edges = HierarchyEdge.objects.all() if slugs is None else HierarchyEdge.objects.filter(child_id__in=list(child_slugs))
+    edges = list(edges.values_list('parent_id', 'child_id'))
+    name_slugs = dict(child_slugs)
+    missing = {parent for parent, child in edges} - set(name_slugs)
+    if missing:
+        name_slugs.update({name: str(slug) for slug, name in ControlSet.objects.filter(name__in=missing).values_list('slug', 'name')})
+    parents = {slug: [] for slug in child_slugs.values()}
+    for parent, child in edges:
+        parents[child_slugs[child]].append(name_slugs[parent])
+    return parents
+
+
+# Compute {descendant: {ancestor: depth}} for every slug in parents. Ancestors of slugs outside
+# the region are taken from known, which holds their (unchanged) closure rows.
+def _compute_ancestors(parents, known):
+    ancestors = {}
+
+    def visit(slug, visiting):
+        if slug in ancestors:
+            return ancestors[slug]
+        if slug not in parents:
+            return known.get(slug, {})
+        visiting.add(slug)
+        result = {}
+        for parent_slug in parents[slug]:
+            if parent_slug in visiting:
+                continue
+            candidates = {parent_slug: 0}
+            candidates.update(visit(parent_slug, visiting))
+            for ancestor, depth in candidates.items():
+                if ancestor != slug and (ancestor not in result or depth + 1 < result[ancestor]):
+                    result[ancestor] = depth + 1
+        visiting.discard(slug)
+        ancestors[slug] = result
+        return result
+
+    for slug in parents:
+        visit(slug, set())
+    return ancestors
+
+
+def _write_closure(region, ancestors):
+    rows = [
+        HierarchyClosure(ancestor=ancestor, descendant=descendant, depth=depth)
+        for descendant, ancestor_depths in ancestors.items()
+        for ancestor, depth in ancestor_depths.items()
+    ]
+    with transaction.atomic():
+        if region is None:
+            HierarchyClosure.objects.all().delete()
+        else:
+            HierarchyClosure.objects.filter(descendant__in=region).delete()
+        HierarchyClosure.objects.bulk_create(rows, batch_size=CLOSURE_BATCH_SIZE)
+
+
+# Recompute the closure rows of the changed hierarchies and everything below them. Nodes outside
+# that region keep their ancestors, so the work is proportional to the affected subgraph.
+def update_closure(*slugs):
+    slugs = {str(slug) for slug in slugs}
+    region = slugs | set(HierarchyClosure.objects.filter(ancestor__in=slugs).values_list('descendant', flat=True))
+    parents = _parent_slugs(region)
+    outside = {parent_slug for parent_slugs in parents.values() for parent_slug in parent_slugs} - region
+    known = {slug: {} for slug in outside}
+    if outside:
+        for descendant, ancestor, depth in HierarchyClosure.objects.filter(descendant__in=outside).values_list('descendant', 'ancestor', 'depth'):
+            known[descendant][ancestor] = depth
+    _write_closure(region, _compute_ancestors(parents, known))
+
+
+def rebuild_closure():
+    _write_closure(None, _compute_ancestors(_parent_slugs(), {}))
+
+
+def ancestor_slugs(slug):
+    return list(HierarchyClosure.objects.filter(descendant=str(slug)).values_list('ancestor', flat=True))
+
+
+def descendant_slugs(slug):
+    return list(HierarchyClosure.objects.filter(ancestor=str(slug)).values_list('descendant', flat=True))
+
+
+# Add references to every given hierarchy with one read of the existing links and one bulk insert.
+def add_references(hierarchy_slugs, references):
+    through = ControlHierarchy.control_set.through
+    hierarchy_slugs = {str(slug) for slug in hierarchy_slugs}
+    reference_names = {reference.pk for reference in references}
+    if not hierarchy_slugs or not reference_names:
+        return
+    existing = set(through.objects.filter(controlhierarchy_id__in=hierarchy_slugs, controlsetreference_id__in=reference_names).values_list('controlhierarchy_id', 'controlsetreference_id'))
+    through.objects.bulk_create([
+        through(controlhierarchy_id=slug, controlsetreference_id=name)
+        for slug in hierarchy_slugs
+        for name in reference_names
+        if (slug, name) not in existing
+    ], batch_size=CLOSURE_BATCH_SIZE)
+    bulk_changed.send(sender=through, slugs=hierarchy_slugs)
+
+
+# Remove references from every given hierarchy with one filtered delete.
+def remove_references(hierarchy_slugs, references):
+    through = ControlHierarchy.control_set.through
+    hierarchy_slugs = {str(slug) for slug in hierarchy_slugs}
+    through.objects.filter(
+        controlhierarchy_id__in=hierarchy_slugs,
+        controlsetreference_id__in={reference.pk for reference in references}
+    ).delete()
+    bulk_changed.send(sender=through, slugs=hierarchy_slugs)
+
+
+# Every child whose parent set changed is recomputed together with its descendants.
+@receiver(edges_changed, sender=HierarchyEdge)
+def update_hierarchy_closure(added, removed, **kwargs):
+    children = {child for parent, child in list(added) + list(removed)}
+    if children:
+        update_closure(*ControlSet.objects.filter(name__in=children).values_list('slug', flat=True))
+
+
+@receiver(post_delete, sender=ControlHierarchy)
+@receiver(post_delete, sender=ControlSet)
+def remove_hierarchy_closure(instance, **kwargs):
+    slug = str(instance.slug)
+    descendants = descendant_slugs(slug)
+    HierarchyClosure.objects.filter(descendant=slug).delete()
+    HierarchyClosure.objects.filter(ancestor=slug).delete()
+    if descendants:
+        update_closure(*descendants)
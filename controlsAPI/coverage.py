@@ -0,0 +1,99 @@
+import threading
+from functools import reduce
+from operator import and_, or_
+from .cache import collection_name, versions
+from .models import ControlHierarchy, ControlSet, ControlSetReference
+
+COVERAGE_OPERATIONS = ('union', 'intersection', 'difference')
+
+
+# Coverage index held by each process. Every ControlSetReference gets a dense integer id and every
+# control set's references are one Python int with bit i set for reference id i, so set algebra
+# between control sets is a handful of big-integer operations instead of through-table queries.
+# It is rebuilt once the shared version of any collection it reads has moved.
+class CoverageIndex:
+    collections = tuple(collection_name(model) for model in (ControlSet, ControlHierarchy, ControlSetReference))
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._version = None
+
+    def _reset(self):
+        self.reference_ids = {}
+        self.reference_names = []
+        self.slug_names = {}
+        self.bitsets = {}
+
+    def build(self, version=None):
+        with self._lock:
+            version = version or versions(self.collections)
+            self._reset()
+            for slug, name in ControlSet.objects.values_list('slug', 'name'):
+                self.slug_names[str(slug)] = name
+                self.bitsets[name] = 0
+            self._load(ControlHierarchy.control_set.through.objects.all())
+            self._version = version
+            self._built = True
+
+    def _ensure_built(self):
+        version = versions(self.collections)
+        if not self._built or version != self._version:
+            self.build(version)
+
+    def _reference_id(self, name):
+        reference_id = self.reference_ids.get(name)
+        if reference_id is None:
+            reference_id = len(self.reference_names)
+            self.reference_ids[name] = reference_id
+            self.reference_names.append(name)
+        return reference_id
+
+    def _load(self, links):
+        for slug, reference_name in links.values_list('controlhierarchy_id', 'controlsetreference_id'):
+            name = self.slug_names.get(str(slug))
+            if name is not None:
+                self.bitsets[name] |= 1 << self._reference_id(reference_name)
+
+    def unknown(self, names):
+        with self._lock:
+            self._ensure_built()
+            return [name for name in names if name not in self.bitsets]
+
+    def control_set_names(self):
+        with self._lock:
+            self._ensure_built()
+            return sorted(self.bitsets)
+
+    def _names(self, bitset):
+        names = []
+        while bitset:
+            lowest = bitset & -bitset
+            names.append(self.reference_names[lowest.bit_length() - 1])
+            bitset ^= lowest
+        return sorted(names)
+
+    # Reference names in the union or intersection of all given control sets, or in the first one
+    # and none of the others for 'difference'. Unknown names raise KeyError.
+    def combine(self, operation, names):
+        with self._lock:
+            self._ensure_built()
+            bitsets = [self.bitsets[name] for name in names]
+            if operation == 'union':
+                bitset = reduce(or_, bitsets, 0)
+            elif operation == 'intersection':
+                bitset = reduce(and_, bitsets)
+            else:
+                bitset = bitsets[0] & ~reduce(or_, bitsets[1:], 0)
+            return self._names(bitset)
+
+    # Number of references shared by every pair of the given control sets; the diagonal holds
+    # each control set's own size.
+    def overlap_matrix(self, names):
+        with self._lock:
+            self._ensure_built()
+            bitsets = [self.bitsets[name] for name in names]
+            return [[(row & column).bit_count() for column in bitsets] for row in bitsets]
+
+
+coverage_index = CoverageIndex()
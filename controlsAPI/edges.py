@@ -0,0 +1,42 @@
+from django.db import transaction
+from .models import HierarchyEdge
+from .signals import edges_changed
+
+
+# Make the given names the complete parent list (or child list) of a ControlSet, writing only the difference.
+def _replace_edges(name, names, own_side):
+    other_side = 'parent' if own_side == 'child' else 'child'
+    wanted = list(dict.fromkeys(names))
+    with transaction.atomic():
+        existing = set(HierarchyEdge.objects.filter(**{own_side + '_id': name}).values_list(other_side + '_id', flat=True))
+        removed = existing - set(wanted)
+        added = [other for other in wanted if other not in existing]
+        if removed:
+            HierarchyEdge.objects.filter(**{own_side + '_id': name, other_side + '_id__in': removed}).delete()
+        HierarchyEdge.objects.bulk_create([HierarchyEdge(**{own_side + '_id': name, other_side + '_id': other}) for other in added])
+        pair = (lambda other: (other, name)) if own_side == 'child' else (lambda other: (name, other))
+        if added or removed:
+            edges_changed.send(sender=HierarchyEdge, added=[pair(other) for other in added], removed=[pair(other) for other in removed])
+
+
+def set_parents(name, parents):
+    _replace_edges(name, parents, 'child')
+
+
+def set_children(name, children):
+    _replace_edges(name, children, 'parent')
+
+
+# Insert (parent, child) pairs that are not stored yet, with one read and one bulk insert.
+def add_edges(pairs):
+    pairs = list(dict.fromkeys(pairs))
+    if not pairs:
+        return []
+    parents = {parent for parent, child in pairs}
+    existing = set(HierarchyEdge.objects.filter(parent_id__in=parents).values_list('parent_id', 'child_id'))
+    added = [pair for pair in pairs if pair not in existing]
+    with transaction.atomic():
+        HierarchyEdge.objects.bulk_create([HierarchyEdge(parent_id=parent, child_id=child) for parent, child in added])
+        if added:
+            edges_changed.send(sender=HierarchyEdge, added=added, removed=[])
+    return added
@@ -0,0 +1,81 @@
+import json
+from django.db import transaction
+from django.db.models.signals import m2m_changed, pre_delete
+from django.dispatch import receiver
+from .closure import ancestor_slugs, descendant_slugs
+from .models import ControlHierarchy, ControlSet, ControlSetReference, EffectiveControls, HierarchyEdge
+from .signals import bulk_changed, edges_changed
+
+
+# Names of the references a hierarchy holds itself or through any of its descendants, read from
+# the memo table and computed with one closure query and one through-table query on a miss.
+def effective_reference_names(slug):
+    slug = str(slug)
+    memo = EffectiveControls.objects.filter(slug=slug).values_list('references', flat=True).first()
+    if memo is not None:
+        return json.loads(memo)
+    through = ControlHierarchy.control_set.through
+    slugs = [slug] + descendant_slugs(slug)
+    names = sorted(set(through.objects.filter(controlhierarchy_id__in=slugs).values_list('controlsetreference_id', flat=True)))
+    EffectiveControls.objects.update_or_create(slug=slug, defaults={'references': json.dumps(names)})
+    return names
+
+
+def _delete_memos(slugs):
+    if slugs is None:
+        EffectiveControls.objects.all().delete()
+    elif slugs:
+        EffectiveControls.objects.filter(slug__in=slugs).delete()
+
+
+# A change below a hierarchy changes the effective controls of it and of every ancestor, and of
+# nothing else. The memos are dropped right away for readers inside the same transaction, and
+# again on commit in case a concurrent reader stored one computed from the old rows.
+def invalidate_effective_controls(slugs=None):
+    if slugs is not None:
+        slugs = {str(slug) for slug in slugs}
+        slugs |= {ancestor for slug in slugs for ancestor in ancestor_slugs(slug)}
+    _delete_memos(slugs)
+    transaction.on_commit(lambda: _delete_memos(slugs))
+
+
+@receiver(m2m_changed, sender=ControlHierarchy.control_set.through)
+def invalidate_on_membership_change(instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_effective_controls([instance.slug])
+    elif pk_set is not None:
+        invalidate_effective_controls(pk_set)
+    else:
+        invalidate_effective_controls()
+
+
+@receiver(bulk_changed)
+def invalidate_on_bulk_change(sender, slugs=None, **kwargs):
+    if sender is ControlHierarchy.control_set.through:
+        invalidate_effective_controls(slugs)
+
+
+# Adding or removing the edge parent -> child changes what parent (and its ancestors) inherit.
+@receiver(edges_changed, sender=HierarchyEdge)
+def invalidate_on_edges_change(added, removed, **kwargs):
+    parents = {parent for parent, child in list(added) + list(removed)}
+    if parents:
+        invalidate_effective_controls(ControlSet.objects.filter(name__in=parents).values_list('slug', flat=True))
+
+
+# Deletes cascade to edges and through rows without per-row signals, so the hierarchies affected
+# are resolved before the delete, while the closure and through rows still exist: a deleted control
+# set takes its own memo and its ancestors' with it, a deleted reference those of the hierarchies
+# holding it and their ancestors.
+@receiver(pre_delete, sender=ControlSet)
+@receiver(pre_delete, sender=ControlHierarchy)
+def invalidate_on_hierarchy_delete(instance, **kwargs):
+    invalidate_effective_controls([instance.slug])
+
+
+@receiver(pre_delete, sender=ControlSetReference)
+def invalidate_on_reference_delete(instance, **kwargs):
+    through = ControlHierarchy.control_set.through
+    invalidate_effective_controls(through.objects.filter(controlsetreference_id=instance.pk).values_list('controlhierarchy_id', flat=True))
@@ -0,0 +1,43 @@
+import json
+from rest_framework.utils.encoders import JSONEncoder
+from .models import Control, ControlHierarchy, ControlSet, ControlSetReference, prefetch_edges
+from .serializers import ControlHierarchyModelSerializer, ControlModelSerializer, ControlsetModelSerializer, ControlsetReferenceModelSerializer
+from .resolvers import resolve_hierarchies
+
+EXPORT_CHUNK_SIZE = 1000
+
+
+# Group a queryset read with server-side batching into lists of at most chunk_size rows.
+def iter_chunks(queryset, chunk_size):
+    chunk = []
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(obj)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Yield every record of the catalog as (type, data), holding at most one chunk in memory.
+def iter_catalog(chunk_size=EXPORT_CHUNK_SIZE):
+    exports = [
+        ("control", Control.objects.order_by('name'), ControlModelSerializer),
+        ("control_set_reference", ControlSetReference.objects.order_by('name'), ControlsetReferenceModelSerializer),
+        ("control_set", ControlSet.objects.order_by('slug'), ControlsetModelSerializer),
+    ]
+    for record_type, queryset, serializer_class in exports:
+        for chunk in iter_chunks(queryset, chunk_size):
+            for data in serializer_class(chunk, many=True).data:
+                yield record_type, data
+    hierarchies = ControlHierarchy.objects.prefetch_related('control_set').order_by('slug')
+    for chunk in iter_chunks(hierarchies, chunk_size):
+        hierarchy_data = ControlHierarchyModelSerializer(prefetch_edges(chunk), many=True).data
+        for data in resolve_hierarchies(hierarchy_data):
+            yield "control_hierarchy", data
+
+
+# Encode the catalog as newline-delimited JSON, one record per line.
+def iter_ndjson(chunk_size=EXPORT_CHUNK_SIZE):
+    for record_type, data in iter_catalog(chunk_size):
+        yield json.dumps({"type": record_type, "data": data}, cls=JSONEncoder) + "\n"
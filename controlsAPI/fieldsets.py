@@ -0,0 +1,90 @@
+from drf_yasg import openapi
+from .models import ControlHierarchy, prefetch_edges
+from .resolvers import resolve_hierarchies
+from .serializers import ControlHierarchyModelSerializer
+
+CONTROL_FIELDS = ('name', 'description')
+HIERARCHY_FIELDS = ('slug', 'control_set', 'parents', 'children', 'control_set_name')
+HIERARCHY_EXPANDABLE = ('control_set',)
+
+
+class FieldsetError(Exception):
+    pass
+
+
+def _names(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+# Read ?fields= and ?expand=. Without ?fields= every field is returned; without ?expand= nested
+# objects are expanded only when ?fields= is absent too, which keeps the full response unchanged.
+def parse_fieldset(request, allowed, expandable=()):
+    fields = None
+    if 'fields' in request.query_params:
+        fields = _names(request.query_params['fields'])
+        unknown = [name for name in fields if name not in allowed]
+        if unknown:
+            raise FieldsetError(f"Unknown fields: {', '.join(unknown)}")
+    if 'expand' in request.query_params:
+        expand = set(_names(request.query_params['expand']))
+        unknown = sorted(expand - set(expandable))
+        if unknown:
+            raise FieldsetError(f"Fields that cannot be expanded: {', '.join(unknown)}")
+    else:
+        expand = set(expandable) if fields is None else set()
+    return fields, expand
+
+
+def trim(data, fields):
+    if fields is None:
+        return data
+    return {name: value for name, value in data.items() if name in fields}
+
+
+def hierarchy_queryset(fields):
+    if fields is None or 'control_set' in fields:
+        return ControlHierarchy.objects.prefetch_related('control_set')
+    return ControlHierarchy.objects.all()
+
+
+# Serialize hierarchies with only the requested fields. Edges, control set names and the
+# control details of the references are only loaded when they end up in the response.
+def hierarchy_data(hierarchies, fields=None, expand=HIERARCHY_EXPANDABLE):
+    def wanted(name):
+        return fields is None or name in fields
+
+    if wanted('parents') or wanted('children'):
+        prefetch_edges(hierarchies)
+    serializer_fields = None
+    if fields is not None:
+        # control_set_name is looked up by slug, so the slug is serialized until the names are in.
+        serializer_fields = [name for name in fields if name != 'control_set_name']
+        if 'control_set_name' in fields:
+            serializer_fields.append('slug')
+    data = ControlHierarchyModelSerializer(hierarchies, many=True, fields=serializer_fields).data
+    resolve_hierarchies(data, control_details=wanted('control_set') and 'control_set' in expand, control_set_names=wanted('control_set_name'))
+    if not wanted('slug'):
+        for control_hierarchy_data in data:
+            control_hierarchy_data.pop('slug', None)
+    return data
+
+
+def fieldset_parameters(allowed, expandable=()):
+    parameters = [
+        openapi.Parameter(
+            'fields',
+            openapi.IN_QUERY,
+            description=f"Comma-separated fields to return, out of {', '.join(allowed)}",
+            type=openapi.TYPE_STRING,
+            required=False
+        )
+    ]
+    if expandable:
+        parameters.append(openapi.Parameter(
+            'expand',
+            openapi.IN_QUERY,
+            description=f"Comma-separated nested fields to resolve, out of {', '.join(expandable)}. Defaults to all of them when 'fields' is not given",
+            type=openapi.TYPE_STRING,
+            required=False
+        ))
+    return parameters
@@ -0,0 +1,108 @@
+import threading
+from collections import deque
+from .cache import collection_name, versions
+from .models import ControlSet, HierarchyEdge
+
+
+# Process-local index of the control set DAG. Control sets are numbered with integer ids and
+# each id maps to the ids of its parents and children, so traversals never go back to the database.
+# Like the search and coverage indexes, it is rebuilt once the shared version of a collection it
+# reads has moved, so writes made by any worker show up in every worker.
+class HierarchyGraph:
+    collections = tuple(collection_name(model) for model in (ControlSet, HierarchyEdge))
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._version = None
+
+    def _reset(self):
+        self.node_ids = {}
+        self.names = []
+        self.parents = []
+        self.children = []
+
+    # Load every control set and edge once and build the adjacency arrays.
+    def build(self, version=None):
+        with self._lock:
+            version = version or versions(self.collections)
+            self._reset()
+            for name in ControlSet.objects.values_list('name', flat=True):
+                self._node(name)
+            for parent_name, child_name in HierarchyEdge.objects.values_list('parent_id', 'child_id'):
+                self._add_edge(parent_name, child_name)
+            self._version = version
+            self._built = True
+
+    def _ensure_built(self):
+        version = versions(self.collections)
+        if not self._built or version != self._version:
+            self.build(version)
+
+    def _node(self, name):
+        node_id = self.node_ids.get(name)
+        if node_id is None:
+            node_id = len(self.names)
+            self.node_ids[name] = node_id
+            self.names.append(name)
+            self.parents.append(set())
+            self.children.append(set())
+        return node_id
+
+    def _add_edge(self, parent_name, child_name):
+        parent_id, child_id = self._node(parent_name), self._node(child_name)
+        self.children[parent_id].add(child_id)
+        self.parents[child_id].add(parent_id)
+
+    def __contains__(self, name):
+        with self._lock:
+            self._ensure_built()
+            return name in self.node_ids
+
+    # Breadth-first walk over one direction of the graph, returning (name, distance) pairs.
+    def _walk(self, name, adjacency):
+        with self._lock:
+            self._ensure_built()
+            start = self.node_ids[name]
+            distances = {start: 0}
+            queue = deque([start])
+            while queue:
+                node_id = queue.popleft()
+                for next_id in getattr(self, adjacency)[node_id]:
+                    if next_id not in distances:
+                        distances[next_id] = distances[node_id] + 1
+                        queue.append(next_id)
+            del distances[start]
+            return [(self.names[node_id], distance) for node_id, distance in distances.items()]
+
+    def ancestors(self, name):
+        return self._walk(name, 'parents')
+
+    def descendants(self, name):
+        return self._walk(name, 'children')
+
+    # Shortest path from source down to target, or from source up to target when target is an ancestor.
+    def path(self, source, target):
+        with self._lock:
+            self._ensure_built()
+            source_id, target_id = self.node_ids[source], self.node_ids[target]
+            for adjacency in (self.children, self.parents):
+                previous = {source_id: None}
+                queue = deque([source_id])
+                while queue and target_id not in previous:
+                    node_id = queue.popleft()
+                    for next_id in adjacency[node_id]:
+                        if next_id not in previous:
+                            previous[next_id] = node_id
+                            queue.append(next_id)
+                if target_id in previous:
+                    path = []
+                    node_id = target_id
+                    while node_id is not None:
+                        path.append(self.names[node_id])
+                        node_id = previous[node_id]
+                    return path[::-1]
+            return None
+
+
+hierarchy_graph = HierarchyGraph()
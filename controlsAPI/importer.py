@@ -0,0 +1,164 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+from django.db import transaction
+from .bulk import bulk_create_control_sets, bulk_create_controls
+from .closure import add_references, ancestor_slugs
+from .edges import add_edges
+from .models import ControlSet, ControlSetReference
+from .signals import bulk_changed
+
+IMPORT_BATCH_SIZE = 1000
+
+# Record types of an import file, in the order they are applied within a batch so that
+# relationships can refer to controls and control sets created earlier in the same batch.
+RECORD_TYPES = ('control', 'control_set', 'reference', 'edge', 'assignment')
+
+
+# Stream records from a CSV file (one column per field, blank cells ignored) or from a
+# JSON-lines file (one object per line). Every record carries a 'type' from RECORD_TYPES.
+def read_records(path):
+    with open(path, newline='', encoding='utf-8') as input_file:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(input_file):
+                yield {key: value for key, value in row.items() if value not in (None, '')}
+        else:
+            for line in input_file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def iter_batches(records, batch_size):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _import_references(records):
+    errors = []
+    names = {record.get('name') for record in records}
+    references = {reference.name: reference for reference in ControlSetReference.objects.filter(name__in=names)}
+    updated = {}
+    for record in records:
+        reference = references.get(record.get('name'))
+        if reference is None:
+            errors.append((record, f"No ControlSetReference found with name {record.get('name')}"))
+        elif not record.get('reference_id'):
+            errors.append((record, "reference_id is required"))
+        else:
+            reference.reference_id = record['reference_id']
+            updated[reference.name] = reference
+    ControlSetReference.objects.bulk_update(list(updated.values()), ['reference_id'])
+    if updated:
+        bulk_changed.send(sender=ControlSetReference, names=list(updated))
+    return len(updated), errors
+
+
+# Edges follow the same depth rules as ControlHierarchyModelSerializer.validate: a parent must
+# have a smaller hierarchy_depth than its child.
+def _import_edges(records):
+    errors = []
+    names = {record.get(field) for record in records for field in ('parent', 'child')}
+    depths = dict(ControlSet.objects.filter(name__in=names).values_list('name', 'hierarchy_depth'))
+    pairs = []
+    for record in records:
+        parent, child = record.get('parent'), record.get('child')
+        if parent not in depths:
+            errors.append((record, f"Parent ControlSet '{parent}' does not exist."))
+        elif child not in depths:
+            errors.append((record, f"Child ControlSet '{child}' does not exist."))
+        elif depths[parent] >= depths[child]:
+            errors.append((record, f"Parent ControlSet '{parent}' has greater hierarchy depth than the current ControlSet(It can't be a parent)."))
+        else:
+            pairs.append((parent, child))
+    return len(add_edges(pairs)), errors
+
+
+def _import_assignments(records):
+    errors = []
+    control_sets = dict(ControlSet.objects.filter(name__in={record.get('control_set') for record in records}).values_list('name', 'slug'))
+    references = {}
+    for reference in ControlSetReference.objects.filter(reference_id__in={record.get('reference_id') for record in records}):
+        references.setdefault(reference.reference_id, reference)
+    assignments = {}
+    for record in records:
+        slug = control_sets.get(record.get('control_set'))
+        reference = references.get(record.get('reference_id'))
+        if slug is None:
+            errors.append((record, f"No ControlSet found with name {record.get('control_set')}"))
+        elif reference is None:
+            errors.append((record, f"ControlSetReference {record.get('reference_id')} does not exist"))
+        else:
+            assignments.setdefault(str(slug), []).append(reference)
+    for slug, slug_references in assignments.items():
+        add_references([slug] + ancestor_slugs(slug), slug_references)
+    return sum(len(slug_references) for slug_references in assignments.values()), errors
+
+
+def _bulk_errors(records, result):
+    return [(records[error['index']], error['errors']) for error in result['errors']]
+
+
+# Validate and write one batch of records in a single transaction. Returns (written, errors).
+def import_batch(records, batch_size=IMPORT_BATCH_SIZE):
+    by_type = {record_type: [] for record_type in RECORD_TYPES}
+    errors = []
+    for record in records:
+        if record.get('type') in by_type:
+            by_type[record['type']].append(record)
+        else:
+            errors.append((record, f"Unknown record type {record.get('type')!r}"))
+    written = 0
+    with transaction.atomic():
+        if by_type['control']:
+            result = bulk_create_controls(by_type['control'], batch_size=batch_size)
+            written += len(result['created'])
+            errors += _bulk_errors(by_type['control'], result)
+        if by_type['control_set']:
+            result = bulk_create_control_sets(by_type['control_set'], batch_size=batch_size)
+            written += len(result['created'])
+            errors += _bulk_errors(by_type['control_set'], result)
+        for record_type, import_function in (('reference', _import_references), ('edge', _import_edges), ('assignment', _import_assignments)):
+            if by_type[record_type]:
+                count, type_errors = import_function(by_type[record_type])
+                written += count
+                errors += type_errors
+    return written, errors
+
+
+def read_checkpoint(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding='utf-8') as checkpoint_file:
+        return json.load(checkpoint_file).get('records', 0)
+
+
+def write_checkpoint(path, records):
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as checkpoint_file:
+        json.dump({'records': records}, checkpoint_file)
+    os.replace(temporary_path, path)
+
+
+# Import a file batch by batch, skipping the records a previous run already committed.
+# Yields a stats dict after every batch so callers can report progress.
+def import_file(path, batch_size=IMPORT_BATCH_SIZE, checkpoint_path=None):
+    done = read_checkpoint(checkpoint_path) if checkpoint_path else 0
+    records = islice(read_records(path), done, None)
+    started = time.monotonic()
+    stats = {'records': done, 'processed': 0, 'written': 0, 'errors': []}
+    for batch in iter_batches(records, batch_size):
+        written, errors = import_batch(batch, batch_size=batch_size)
+        stats['records'] += len(batch)
+        stats['processed'] += len(batch)
+        stats['written'] += written
+        stats['errors'] = errors
+        stats['elapsed'] = time.monotonic() - started
+        if checkpoint_path:
+            write_checkpoint(checkpoint_path, stats['records'])
+        yield stats
@@ -0,0 +1,59 @@
+import time
+from django.core.management.base import BaseCommand
+from controlsAPI.coverage import coverage_index
+from controlsAPI.models import ControlHierarchy, ControlSet
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+# What the comparison endpoints would otherwise run: one through-table query per pair of control sets.
+def m2m_overlap_matrix(names):
+    through = ControlHierarchy.control_set.through
+    slugs = dict(ControlSet.objects.filter(name__in=names).values_list('name', 'slug'))
+    matrix = [[0] * len(names) for _ in names]
+    for row, row_name in enumerate(names):
+        for column in range(row, len(names)):
+            shared = through.objects.filter(controlhierarchy_id=slugs[row_name]).filter(
+                controlsetreference_id__in=through.objects.filter(controlhierarchy_id=slugs[names[column]]).values('controlsetreference_id')
+            ).count()
+            matrix[row][column] = matrix[column][row] = shared
+    return matrix
+
+
+def m2m_intersection(names):
+    through = ControlHierarchy.control_set.through
+    slugs = ControlSet.objects.filter(name__in=names).values_list('slug', flat=True)
+    references = None
+    for slug in slugs:
+        linked = set(through.objects.filter(controlhierarchy_id=slug).values_list('controlsetreference_id', flat=True))
+        references = linked if references is None else references & linked
+    return sorted(references or ())
+
+
+class Command(BaseCommand):
+    help = "Compare the bitset coverage index with through-table queries on the control sets in the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--control-sets', type=int, default=50, help="Number of control sets in the overlap matrix")
+
+    def handle(self, *args, **options):
+        _, elapsed = timed(coverage_index.build)
+        self.stdout.write(f"index build: {elapsed * 1000:.1f} ms")
+        names = coverage_index.control_set_names()[:options['control_sets']]
+        if len(names) < 2:
+            self.stdout.write("At least two control sets are needed")
+            return
+        self.stdout.write(f"{'query':<25} {'m2m ms':>10} {'bitset ms':>10} {'speedup':>8}")
+        for label, m2m, bitset in (
+            (f"overlap {len(names)}x{len(names)}", lambda: m2m_overlap_matrix(names), lambda: coverage_index.overlap_matrix(names)),
+            (f"intersection of {len(names)}", lambda: m2m_intersection(names), lambda: coverage_index.combine('intersection', names)),
+        ):
+            expected, m2m_elapsed = timed(m2m)
+            result, bitset_elapsed = timed(bitset)
+            if result != expected:
+                self.stderr.write(f"{label}: results differ")
+            self.stdout.write(f"{label:<25} {m2m_elapsed * 1000:>10.1f} {bitset_elapsed * 1000:>10.2f} {m2m_elapsed / max(bitset_elapsed, 1e-9):>8.0f}x")
@@ -0,0 +1,61 @@
+import random
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from controlsAPI.middleware import brotli, compress
+from controlsAPI.renderers import FastJSONRenderer
+
+WORDS = "access control policy review audit log account privilege network data encryption key backup incident response asset vendor risk".split()
+
+
+# A controlhierarchies_details-shaped payload: control sets holding resolved references to the controls.
+def synthetic_catalog(controls, control_sets, references_per_set, seed=0):
+    rng = random.Random(seed)
+    names = [f"Control {index}" for index in range(controls)]
+    descriptions = {name: " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 30))) for name in names}
+    set_names = [f"Control Set {index}" for index in range(control_sets)]
+    results = []
+    for index, set_name in enumerate(set_names):
+        control_set = []
+        for control_index in rng.sample(range(controls), min(references_per_set, controls)):
+            name = names[control_index]
+            control_set.append({'name': name, 'reference_id': f"REF-{control_index:06d}", 'control_name': name, 'description': descriptions[name]})
+        results.append({
+            'slug': str(uuid.UUID(int=rng.getrandbits(128))),
+            'control_set': control_set,
+            'parents': set_names[max(0, index - 2):index],
+            'children': set_names[index + 1:index + 3],
+            'control_set_name': set_name,
+        })
+    return {'next': None, 'previous': None, 'results': results}
+
+
+class Command(BaseCommand):
+    help = "Compare JSON encode time and compressed size of a synthetic catalog for the available renderers and encodings"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--controls', type=int, default=50000, help="Number of controls in the catalog")
+        parser.add_argument('--control-sets', type=int, default=1000, help="Number of control sets")
+        parser.add_argument('--references-per-set', type=int, default=50, help="References listed by every control set")
+        parser.add_argument('--repeat', type=int, default=5, help="Encodings timed per renderer, the best one is reported")
+
+    def handle(self, *args, **options):
+        data = synthetic_catalog(options['controls'], options['control_sets'], options['references_per_set'])
+        self.stdout.write(f"{'renderer':<20} {'best encode ms':>15} {'bytes':>12}")
+        content = None
+        for renderer in (JSONRenderer(), FastJSONRenderer()):
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                content = renderer.render(data)
+                timings.append(time.perf_counter() - started)
+            self.stdout.write(f"{type(renderer).__name__:<20} {min(timings) * 1000:>15.1f} {len(content):>12}")
+        self.stdout.write(f"\n{'encoding':<20} {'compress ms':>15} {'bytes':>12} {'ratio':>8}")
+        for encoding in ['gzip'] + (['br'] if brotli is not None else []):
+            started = time.perf_counter()
+            compressed = compress(content, encoding)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{encoding:<20} {elapsed * 1000:>15.1f} {len(compressed):>12} {len(content) / len(compressed):>8.1f}")
+        if brotli is None:
+            self.stdout.write("br skipped: the brotli package is not installed")
@@ -0,0 +1,49 @@
+import asyncio
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+
+DEFAULT_PATHS = ['/controlhierarchies_details/', '/async/controlhierarchies_details/']
+
+
+class Command(BaseCommand):
+    help = "Measure requests/sec of details endpoints through the ASGI handler at several concurrency levels"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=DEFAULT_PATHS, help="Endpoints to compare, e.g. a sync path and its /async/ counterpart")
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 200], help="Numbers of concurrent clients")
+        parser.add_argument('--requests', type=int, default=2000, help="Requests sent per path and concurrency level")
+        parser.add_argument('--with-cache', action='store_true', help="Keep the response cache enabled instead of measuring the database path")
+
+    def handle(self, *args, **options):
+        overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver']}
+        if not options['with_cache']:
+            overrides.update(CACHES={'benchmark': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}, CONTROLS_API_CACHE='benchmark')
+        with override_settings(**overrides):
+            self.run(options)
+
+    def run(self, options):
+        self.stdout.write(f"{'path':<45} {'clients':>8} {'requests':>9} {'errors':>7} {'req/s':>10}")
+        for path in options['paths']:
+            for concurrency in options['concurrency']:
+                elapsed, errors = asyncio.run(self.load(path, concurrency, options['requests']))
+                self.stdout.write(f"{path:<45} {concurrency:>8} {options['requests']:>9} {errors:>7} {options['requests'] / elapsed:>10.1f}")
+
+    # Requests go through Django's ASGI handler, as under uvicorn: sync views are run one at a time on
+    # the thread-sensitive executor, async views on the event loop.
+    async def load(self, path, concurrency, total):
+        client = AsyncClient()
+        remaining = iter(range(total))
+        errors = 0
+
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                response = await client.get(path)
+                if response.status_code != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - started, errors
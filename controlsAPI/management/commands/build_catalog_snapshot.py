@@ -0,0 +1,17 @@
+import os
+from django.core.management.base import BaseCommand
+from controlsAPI.snapshot import build_snapshot, snapshot_path
+
+
+class Command(BaseCommand):
+    help = "Write the resolved ControlHierarchies to the catalog snapshot file served by catalog_snapshot/"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Snapshot file to write, CONTROLS_API_SNAPSHOT_PATH by default")
+
+    def handle(self, *args, **options):
+        path = options['output'] or snapshot_path()
+        index = build_snapshot(path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {index['count']} ControlHierarchies ({os.path.getsize(path)} bytes) to {path} at change log sequence {index['sequence']}"
+        ))
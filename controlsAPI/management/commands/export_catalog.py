@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from controlsAPI.export import EXPORT_CHUNK_SIZE, iter_ndjson
+
+
+class Command(BaseCommand):
+    help = "Stream the whole catalog (controls, references, control sets and resolved hierarchies) as NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help="File to write to, defaults to stdout")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help="Rows fetched per database batch")
+
+    def handle(self, *args, **options):
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                for line in iter_ndjson(options['chunk_size']):
+                    output.write(line)
+        else:
+            for line in iter_ndjson(options['chunk_size']):
+                self.stdout.write(line, ending='')
@@ -0,0 +1,42 @@
+import json
+import os
+from django.core.management.base import BaseCommand, CommandError
+from controlsAPI.importer import IMPORT_BATCH_SIZE, import_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a framework catalog from a CSV or JSON-lines file. Every record has a 'type' of "
+        "control (name, description), control_set (name, hierarchy_depth), reference (name, reference_id), "
+        "edge (parent, child) or assignment (control_set, reference_id)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV (.csv) or JSON-lines file to import")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help="Records validated and written per transaction")
+        parser.add_argument('--checkpoint', help="Checkpoint file used to resume an interrupted import, defaults to <path>.checkpoint")
+        parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint and import from the first record")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f"No file found at {path}")
+        if options['batch_size'] <= 0:
+            raise CommandError("--batch-size must be positive")
+        checkpoint_path = options['checkpoint'] or path + '.checkpoint'
+        if options['restart'] and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        stats = None
+        error_count = 0
+        for stats in import_file(path, batch_size=options['batch_size'], checkpoint_path=checkpoint_path):
+            for record, errors in stats['errors']:
+                self.stderr.write(f"{json.dumps(record)}: {errors}")
+            error_count += len(stats['errors'])
+            rate = stats['processed'] / stats['elapsed'] if stats['elapsed'] else 0
+            self.stdout.write(f"{stats['records']} records read, {stats['written']} written, {error_count} rejected ({rate:.0f} records/s)")
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        if stats is None:
+            self.stdout.write("Nothing to import")
+            return
+        self.stdout.write(self.style.SUCCESS(f"Imported {stats['processed']} records in {stats['elapsed']:.1f}s"))
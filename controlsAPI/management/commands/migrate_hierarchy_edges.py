@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from controlsAPI.edges import add_edges
+from controlsAPI.models import ControlHierarchy, ControlSet
+
+# Values the old comma-joined ListField stored when a control set had no parents or children.
+EMPTY_NAMES = {"", "None"}
+
+
+def split_names(value):
+    if isinstance(value, list):
+        names = value
+    else:
+        names = (value or "").split(',')
+    return [name for name in names if name not in EMPTY_NAMES]
+
+
+class Command(BaseCommand):
+    help = "Copy the legacy comma-joined parents/children of every ControlHierarchy document into HierarchyEdge rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drop-legacy', action='store_true', help="Remove the parents/children fields from the documents once copied")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'djongo':
+            raise CommandError("The legacy parents/children fields only exist in the MongoDB documents, run this against the djongo database")
+        connection.ensure_connection()
+        collection = connection.connection[ControlHierarchy._meta.db_table]
+        slug_names = {str(slug): name for slug, name in ControlSet.objects.values_list('slug', 'name')}
+        pairs = []
+        for document in collection.find({}, {'slug': 1, 'parents': 1, 'children': 1}):
+            name = slug_names.get(str(document.get('slug')))
+            if name is None:
+                continue
+            for parent_name in split_names(document.get('parents')):
+                pairs.append((parent_name, name))
+            for child_name in split_names(document.get('children')):
+                pairs.append((name, child_name))
+        known_names = set(slug_names.values())
+        valid_pairs = [(parent, child) for parent, child in pairs if parent in known_names and child in known_names]
+        skipped = len(pairs) - len(valid_pairs)
+        # add_edges() sends edges_changed, which also brings HierarchyClosure up to date.
+        added = add_edges(valid_pairs)
+        if options['drop_legacy']:
+            collection.update_many({}, {'$unset': {'parents': "", 'children': ""}})
+        self.stdout.write(self.style.SUCCESS(f"{len(added)} HierarchyEdge rows created, {skipped} edges naming unknown ControlSets skipped"))
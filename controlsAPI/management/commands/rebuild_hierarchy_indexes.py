@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from controlsAPI.closure import rebuild_closure
+from controlsAPI.models import HierarchyClosure
+
+
+class Command(BaseCommand):
+    help = "Rebuild the HierarchyClosure index from every HierarchyEdge"
+
+    def handle(self, *args, **options):
+        rebuild_closure()
+        self.stdout.write(self.style.SUCCESS(f"HierarchyClosure rebuilt with {HierarchyClosure.objects.count()} rows"))
@@ -0,0 +1,79 @@
+import gzip
+import re
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - gzip only
+    brotli = None
+
+DEFAULT_MIN_BYTES = 1024
+_accept_encoding_re = re.compile(r'\s*([^\s;,]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?')
+
+
+# Encodings the client accepts, with their q-values. An encoding listed with q=0 is refused.
+def accepted_encodings(header):
+    encodings = {}
+    for part in header.split(','):
+        match = _accept_encoding_re.match(part)
+        if match:
+            try:
+                encodings[match.group(1).lower()] = float(match.group(2)) if match.group(2) else 1.0
+            except ValueError:
+                continue
+    return encodings
+
+
+def choose_encoding(header, streaming=False):
+    encodings = accepted_encodings(header)
+    candidates = ['gzip'] if streaming or brotli is None else ['br', 'gzip']
+    best, best_q = None, 0.0
+    for encoding in candidates:
+        q = encodings.get(encoding, encodings.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content, quality=getattr(settings, 'CONTROLS_API_BROTLI_QUALITY', 5))
+    return gzip.compress(content, compresslevel=getattr(settings, 'CONTROLS_API_GZIP_LEVEL', 6))
+
+
+# Compress responses with brotli (when installed) or gzip, following the client's Accept-Encoding.
+# Bodies smaller than CONTROLS_API_COMPRESSION_MIN_BYTES are sent as they are, since compressing
+# them costs more than it saves. Streaming responses are gzipped chunk by chunk.
+class CompressionMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_bytes = getattr(settings, 'CONTROLS_API_COMPRESSION_MIN_BYTES', DEFAULT_MIN_BYTES)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        # A byte range must stay a slice of the uncompressed body.
+        if response.has_header('Content-Encoding') or response.has_header('Content-Range'):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), response.streaming)
+        if encoding is None:
+            return response
+        if response.streaming:
+            response.streaming_content = compress_sequence(response.streaming_content)
+            del response['Content-Length']
+        else:
+            if len(response.content) < self.min_bytes:
+                return response
+            compressed = compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+        # The body is no longer byte-for-byte the one a strong ETag was computed for.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
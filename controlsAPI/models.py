@@ -1,27 +1,10 @@
+from collections import defaultdict
 from django.db import models
+from django.db.models import Q
 from django.db.models.signals import post_save
 import uuid
 from django.dispatch import receiver 
 
-class ListField(models.TextField):
-    #Convert the database value to a list.
-    def from_db_value(self, value, expression, connection):
-        if value is None:
-            return []
-        return value.split(',')
-
-    #Convert the input value to a list.
-    def to_python(self, value):
-        if isinstance(value, list):
-            return value
-        if value is None:
-            return []
-        return value.split(',')
-
-    #Convert the list to a database value.
-    def get_prep_value(self, value): 
-        return ','.join(value)
-    
 class Control(models.Model):
     name = models.TextField(primary_key=True,unique=True)
     description = models.TextField()
@@ -44,8 +27,72 @@ def get_empty_queryset():
 class ControlHierarchy(models.Model):
     slug = models.TextField(primary_key=True, editable=False, default=(uuid.uuid4))
     control_set = models.ManyToManyField(ControlSetReference, blank=True, related_name='control_hierarchies', default=get_empty_queryset)
-    parents = ListField(default=["None"])
-    children = ListField(default=["None"])
+
+    #Names of the parent and child ControlSets, read from HierarchyEdge unless prefetch_edges() already loaded them.
+    @property
+    def parents(self):
+        if not hasattr(self, '_parents'):
+            prefetch_edges([self])
+        return self._parents
+
+    @property
+    def children(self):
+        if not hasattr(self, '_children'):
+            prefetch_edges([self])
+        return self._children
+
+#One parent -> child edge of the ControlSet hierarchy, keyed by ControlSet name.
+class HierarchyEdge(models.Model):
+    parent = models.ForeignKey(ControlSet, to_field='name', on_delete=models.CASCADE, related_name='child_edges')
+    child = models.ForeignKey(ControlSet, to_field='name', on_delete=models.CASCADE, related_name='parent_edges')
+
+    class Meta:
+        unique_together = ('parent', 'child')
+        indexes = [models.Index(fields=['child'])]
+
+#Load parents and children for many hierarchies with one ControlSet query and one HierarchyEdge query.
+def prefetch_edges(hierarchies):
+    hierarchies = list(hierarchies)
+    names = dict(ControlSet.objects.filter(slug__in=[str(hierarchy.slug) for hierarchy in hierarchies]).values_list('slug', 'name'))
+    parents, children = defaultdict(list), defaultdict(list)
+    if names:
+        edges = HierarchyEdge.objects.filter(Q(parent_id__in=list(names.values())) | Q(child_id__in=list(names.values()))).order_by('id')
+        for parent, child in edges.values_list('parent_id', 'child_id'):
+            children[parent].append(child)
+            parents[child].append(parent)
+    for hierarchy in hierarchies:
+        name = names.get(str(hierarchy.slug))
+        hierarchy._parents = parents.get(name, [])
+        hierarchy._children = children.get(name, [])
+    return hierarchies
+
+#Transitive closure of the HierarchyEdge relation: one row per (ancestor, descendant) pair of ControlHierarchy slugs.
+class HierarchyClosure(models.Model):
+    ancestor = models.TextField()
+    descendant = models.TextField()
+    depth = models.IntegerField()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        indexes = [models.Index(fields=['descendant'])]
+
+#Memoized effective controls of a ControlHierarchy: names of the ControlSetReferences it holds or inherits from its descendants, as a JSON list.
+class EffectiveControls(models.Model):
+    slug = models.TextField(primary_key=True)
+    references = models.TextField()
+
+#Version number of one model collection, incremented by every write to it. Cache keys and ETags of the details endpoints are built from these.
+class CollectionVersion(models.Model):
+    collection = models.TextField(primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+#Append-only log of the objects changed, created or deleted, as returned by the details endpoints. sequence
+#only grows, so a mirror that has applied everything up to some sequence asks for the entries after it.
+class ChangeLogEntry(models.Model):
+    sequence = models.BigAutoField(primary_key=True)
+    collection = models.TextField()
+    key = models.TextField()
+    changed_at = models.DateTimeField(auto_now_add=True)
 
 @receiver(post_save, sender=ControlSet)
 def create_control_hierarchy(instance, created, **kwargs):
@@ -0,0 +1,50 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from drf_yasg import openapi
+
+
+# Seek pagination on the primary key, so every page is a "key > cursor" range query instead of an OFFSET scan.
+class KeysetPagination(CursorPagination):
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class ControlPagination(KeysetPagination):
+    ordering = 'name'
+
+
+class ControlSetReferencePagination(KeysetPagination):
+    ordering = 'name'
+
+
+class ControlSetPagination(KeysetPagination):
+    ordering = 'slug'
+
+
+class ControlHierarchyPagination(KeysetPagination):
+    ordering = 'slug'
+
+
+# Search results are ranked in memory, so they are paged by number instead of by key.
+class SearchPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+pagination_parameters = [
+    openapi.Parameter(
+        'cursor',
+        openapi.IN_QUERY,
+        description="Opaque cursor taken from the 'next' link of the previous page",
+        type=openapi.TYPE_STRING,
+        required=False
+    ),
+    openapi.Parameter(
+        'page_size',
+        openapi.IN_QUERY,
+        description="Number of results to return per page",
+        type=openapi.TYPE_INTEGER,
+        required=False
+    )
+]
@@ -0,0 +1,33 @@
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Q
+from .models import ControlSetReference
+from .signals import bulk_changed
+
+
+# Give a reference a new reference_id, together with every other reference still using its old
+# id, in one filtered update. An unset old id is never propagated.
+def change_reference_id(reference, new_reference_id):
+    query = Q(name=reference.name)
+    if reference.reference_id is not None:
+        query |= Q(reference_id=reference.reference_id)
+    with transaction.atomic():
+        names = list(ControlSetReference.objects.filter(query).values_list('name', flat=True))
+        updated = ControlSetReference.objects.filter(name__in=names).update(reference_id=new_reference_id)
+        bulk_changed.send(sender=ControlSetReference, names=names)
+    return updated
+
+
+# Apply many old -> new reference_id changes in one transaction. The affected rows are read before
+# any write, so swaps and chains (A -> B, B -> C) move each row exactly once.
+def change_reference_ids(mapping):
+    names = defaultdict(list)
+    with transaction.atomic():
+        for name, reference_id in ControlSetReference.objects.filter(reference_id__in=list(mapping)).values_list('name', 'reference_id'):
+            names[reference_id].append(name)
+        for old_reference_id, new_reference_id in mapping.items():
+            if names[old_reference_id] and old_reference_id != new_reference_id:
+                ControlSetReference.objects.filter(name__in=names[old_reference_id]).update(reference_id=new_reference_id)
+        if any(names.values()):
+            bulk_changed.send(sender=ControlSetReference, names=[name for reference_names in names.values() for name in reference_names])
+    return {old_reference_id: len(names[old_reference_id]) for old_reference_id in mapping}
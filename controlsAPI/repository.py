@@ -0,0 +1,229 @@
+import copy
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from django.conf import settings
+from django.db import connection
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from pymongo.errors import PyMongoError
+from .models import Control, ControlHierarchy, ControlSet, ControlSetReference, HierarchyEdge, prefetch_edges
+from .resolvers import add_control_details
+from .signals import bulk_changed, bulk_created, edges_changed
+
+logger = logging.getLogger(__name__)
+
+_lookup_cache = ContextVar('controlsapi_lookup_cache', default=None)
+
+
+# Share repository results between the operations run inside the block, e.g. one /batch/ request.
+# Any write clears them, so a lookup never returns data older than the last write.
+@contextmanager
+def shared_lookups():
+    token = _lookup_cache.set({})
+    try:
+        yield
+    finally:
+        _lookup_cache.reset(token)
+
+
+def _shared(method):
+    @wraps(method)
+    def wrapper(self, key):
+        if key is not None and not isinstance(key, str):
+            key = tuple(key)
+        cache = _lookup_cache.get()
+        if cache is None:
+            return method(self, key)
+        cache_key = (method.__name__, key)
+        if cache_key not in cache:
+            cache[cache_key] = method(self, key)
+        return copy.deepcopy(cache[cache_key])
+    return wrapper
+
+
+# Hot read queries of the details endpoints, returned as plain dicts shaped like the serializer output.
+class OrmRepository:
+    @_shared
+    def control(self, name):
+        return Control.objects.filter(name=name).values('name', 'description').first()
+
+    @_shared
+    def reference(self, name):
+        return ControlSetReference.objects.filter(name=name).values('name', 'reference_id').first()
+
+    @_shared
+    def control_set(self, name):
+        return ControlSet.objects.filter(name=name).values('slug', 'name', 'hierarchy_depth').first()
+
+    # Map every given reference_id to the name of the first ControlSetReference using it.
+    @_shared
+    def reference_names(self, reference_ids):
+        names = {}
+        for reference_id, name in ControlSetReference.objects.filter(reference_id__in=set(reference_ids)).order_by('name').values_list('reference_id', 'name'):
+            names.setdefault(reference_id, name)
+        return names
+
+    # Return (control_set, hierarchy) for the control set called name; either is None when missing.
+    @_shared
+    def hierarchy_details(self, name):
+        control_set = self.control_set(name)
+        if control_set is None:
+            return None, None
+        hierarchy = ControlHierarchy.objects.prefetch_related('control_set').filter(slug=control_set['slug']).first()
+        if hierarchy is None:
+            return control_set, None
+        prefetch_edges([hierarchy])
+        control_set_data = [{'name': reference.name, 'reference_id': reference.reference_id} for reference in hierarchy.control_set.all()]
+        add_control_details(control_set_data)
+        return control_set, {
+            'slug': str(hierarchy.slug),
+            'control_set': control_set_data,
+            'parents': hierarchy.parents,
+            'children': hierarchy.children,
+            'control_set_name': control_set['name'],
+        }
+
+
+# Same queries sent straight to the MongoDB collections behind the models, skipping djongo's SQL
+# translation. Any driver error falls back to the ORM repository.
+class MongoRepository:
+    def collection(self, model):
+        connection.ensure_connection()
+        return connection.connection[model._meta.db_table]
+
+    def _find_one(self, model, query, fields, fallback):
+        try:
+            document = self.collection(model).find_one(query, {field: 1 for field in fields} | {'_id': 0})
+        except PyMongoError:
+            logger.exception("MongoDB read of %s failed, falling back to the ORM", model._meta.db_table)
+            return fallback()
+        return None if document is None else {field: document.get(field) for field in fields}
+
+    @_shared
+    def control(self, name):
+        return self._find_one(Control, {'name': name}, ['name', 'description'], lambda: orm_repository.control(name))
+
+    @_shared
+    def reference(self, name):
+        return self._find_one(ControlSetReference, {'name': name}, ['name', 'reference_id'], lambda: orm_repository.reference(name))
+
+    @_shared
+    def control_set(self, name):
+        return self._find_one(ControlSet, {'name': name}, ['slug', 'name', 'hierarchy_depth'], lambda: orm_repository.control_set(name))
+
+    @_shared
+    def reference_names(self, reference_ids):
+        try:
+            documents = self.collection(ControlSetReference).find(
+                {'reference_id': {'$in': list(set(reference_ids))}}, {'_id': 0, 'reference_id': 1, 'name': 1}
+            ).sort('name', 1)
+            names = {}
+            for document in documents:
+                names.setdefault(document['reference_id'], document['name'])
+            return names
+        except PyMongoError:
+            logger.exception("MongoDB read of ControlSetReference failed, falling back to the ORM")
+            return orm_repository.reference_names(reference_ids)
+
+    # One aggregation from the control set to its hierarchy, the hierarchy's references, their
+    # controls and the edges naming the control set.
+    @_shared
+    def hierarchy_details(self, name):
+        through = ControlHierarchy.control_set.through
+        pipeline = [
+            {'$match': {'name': name}},
+            {'$limit': 1},
+            {'$lookup': {'from': ControlHierarchy._meta.db_table, 'localField': 'slug', 'foreignField': 'slug', 'as': 'hierarchy'}},
+            {'$lookup': {'from': through._meta.db_table, 'localField': 'slug', 'foreignField': 'controlhierarchy_id', 'as': 'links'}},
+            {'$lookup': {'from': ControlSetReference._meta.db_table, 'localField': 'links.controlsetreference_id', 'foreignField': 'name', 'as': 'references'}},
+            # Control names are resolved through reference_id, like add_control_details does.
+            {'$lookup': {
+                'from': ControlSetReference._meta.db_table,
+                'let': {'reference_ids': {'$setDifference': ['$references.reference_id', [None]]}},
+                'pipeline': [
+                    {'$match': {'$expr': {'$in': ['$reference_id', '$$reference_ids']}}},
+                    {'$project': {'_id': 0, 'reference_id': 1, 'name': 1}},
+                ],
+                'as': 'resolved',
+            }},
+            {'$lookup': {'from': Control._meta.db_table, 'localField': 'resolved.name', 'foreignField': 'name', 'as': 'controls'}},
+            {'$lookup': {'from': HierarchyEdge._meta.db_table, 'localField': 'name', 'foreignField': 'child_id', 'as': 'parent_edges'}},
+            {'$lookup': {'from': HierarchyEdge._meta.db_table, 'localField': 'name', 'foreignField': 'parent_id', 'as': 'child_edges'}},
+            {'$project': {
+                '_id': 0, 'slug': 1, 'name': 1, 'hierarchy_depth': 1,
+                'hierarchy.slug': 1,
+                'links.controlsetreference_id': 1,
+                'references.reference_id': 1, 'references.name': 1,
+                'resolved': 1,
+                'controls.name': 1, 'controls.description': 1,
+                'parent_edges.id': 1, 'parent_edges.parent_id': 1,
+                'child_edges.id': 1, 'child_edges.child_id': 1,
+            }},
+        ]
+        try:
+            documents = list(self.collection(ControlSet).aggregate(pipeline))
+        except PyMongoError:
+            logger.exception("MongoDB aggregation of ControlHierarchy details failed, falling back to the ORM")
+            return orm_repository.hierarchy_details(name)
+        if not documents:
+            return None, None
+        document = documents[0]
+        control_set = {field: document.get(field) for field in ('slug', 'name', 'hierarchy_depth')}
+        if not document['hierarchy']:
+            return control_set, None
+        return control_set, self._hierarchy_data(document)
+
+    # Shape the aggregation result like OrmRepository.hierarchy_details.
+    def _hierarchy_data(self, document):
+        references = {reference['name']: reference for reference in document['references']}
+        reference_names = {}
+        for reference in sorted(document['resolved'], key=lambda reference: reference['name']):
+            reference_names.setdefault(reference.get('reference_id'), reference['name'])
+        descriptions = {control['name']: control['description'] for control in document['controls']}
+        control_set_data = []
+        for link in document['links']:
+            reference = references.get(link['controlsetreference_id'])
+            if reference is None:
+                continue
+            item = {'name': reference['name'], 'reference_id': reference.get('reference_id')}
+            control_name = reference_names.get(item['reference_id']) if item['reference_id'] is not None else None
+            item['control_name'] = control_name if control_name is not None else "Reference not found"
+            item['description'] = descriptions.get(control_name, "Description not found")
+            control_set_data.append(item)
+        return {
+            'slug': document['slug'],
+            'control_set': control_set_data,
+            'parents': [edge['parent_id'] for edge in sorted(document['parent_edges'], key=lambda edge: edge['id'])],
+            'children': [edge['child_id'] for edge in sorted(document['child_edges'], key=lambda edge: edge['id'])],
+            'control_set_name': document['name'],
+        }
+
+
+orm_repository = OrmRepository()
+mongo_repository = MongoRepository()
+
+
+# CONTROLS_API_READ_BACKEND selects 'mongo' or 'orm'. The MongoDB path needs the djongo database,
+# so any other engine always reads through the ORM.
+def get_repository():
+    if getattr(settings, 'CONTROLS_API_READ_BACKEND', 'orm') == 'mongo' and connection.vendor == 'djongo':
+        return mongo_repository
+    return orm_repository
+
+
+def _clear_shared_lookups(**kwargs):
+    cache = _lookup_cache.get()
+    if cache:
+        cache.clear()
+
+
+# Only the models behind the lookups: a post_delete receiver without a sender would turn off the
+# single-query fast delete for every other model too (closure, memo and log tables).
+for model in (Control, ControlSet, ControlSetReference, ControlHierarchy, HierarchyEdge):
+    post_save.connect(_clear_shared_lookups, sender=model, dispatch_uid=f"controlsapi_shared_lookups_save_{model._meta.model_name}")
+    post_delete.connect(_clear_shared_lookups, sender=model, dispatch_uid=f"controlsapi_shared_lookups_delete_{model._meta.model_name}")
+m2m_changed.connect(_clear_shared_lookups, sender=ControlHierarchy.control_set.through, dispatch_uid="controlsapi_shared_lookups_m2m")
+bulk_created.connect(_clear_shared_lookups, dispatch_uid="controlsapi_shared_lookups_bulk_created")
+bulk_changed.connect(_clear_shared_lookups, dispatch_uid="controlsapi_shared_lookups_bulk_changed")
+edges_changed.connect(_clear_shared_lookups, dispatch_uid="controlsapi_shared_lookups_edges")
@@ -0,0 +1,37 @@
+from .models import Control, ControlSet, ControlSetReference
+
+
+# Add control_name and description to every control_set item, loading all references and controls with one query each.
+def add_control_details(control_set_data):
+    reference_ids = {item.get('reference_id') for item in control_set_data if item.get('reference_id') is not None}
+    reference_names = {}
+    if reference_ids:
+        for reference_id, name in ControlSetReference.objects.filter(reference_id__in=reference_ids).values_list('reference_id', 'name'):
+            reference_names.setdefault(reference_id, name)
+    descriptions = {}
+    if reference_names:
+        descriptions = dict(Control.objects.filter(name__in=set(reference_names.values())).values_list('name', 'description'))
+    for control_set_item in control_set_data:
+        control_name = reference_names.get(control_set_item.get('reference_id'))
+        if control_name is None:
+            control_set_item['control_name'] = "Reference not found"
+            control_set_item['description'] = "Description not found"
+            continue
+        control_set_item['control_name'] = control_name
+        control_set_item['description'] = descriptions.get(control_name, "Description not found")
+
+
+# Resolve a page of serialized hierarchies in a fixed number of queries, whatever the page size.
+# Either part can be skipped when it is not part of the response.
+def resolve_hierarchies(hierarchy_data, control_details=True, control_set_names=True):
+    if control_details:
+        control_set_data = []
+        for control_hierarchy_data in hierarchy_data:
+            control_set_data.extend(control_hierarchy_data.get('control_set', []))
+        add_control_details(control_set_data)
+    if control_set_names:
+        slugs = {control_hierarchy_data.get('slug') for control_hierarchy_data in hierarchy_data}
+        names = dict(ControlSet.objects.filter(slug__in=slugs).values_list('slug', 'name')) if slugs else {}
+        for control_hierarchy_data in hierarchy_data:
+            control_hierarchy_data['control_set_name'] = names.get(control_hierarchy_data.get('slug'), "Name not found")
+    return hierarchy_data
@@ -0,0 +1,166 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .cache import collection_name, versions
+from .models import Control
+from .signals import bulk_created
+
+SEARCH_BUILD_CHUNK_SIZE = 2000
+_token_re = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return _token_re.findall((text or "").lower())
+
+
+# Search index over Controls, held by each process: a sorted list of lowercased names for prefix
+# lookups (a bisect finds the first match, the rest follow in order) and an inverted index from
+# description tokens to the controls using them, with term frequencies for ranking. It remembers
+# the shared Control collection version it is up to date with. Writes of this process are applied
+# in place once committed and move it along; a version moved by another worker's write is only
+# noticed by the next search, which rebuilds the index.
+class ControlSearchIndex:
+    collections = (collection_name(Control),)
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._version = None
+
+    def _reset(self):
+        self.sorted_names = []
+        self.display_names = {}
+        self.postings = defaultdict(dict)
+        self.document_tokens = {}
+
+    def build(self, version=None):
+        with self._lock:
+            # Read before the rows, so a write made during the build triggers another one.
+            version = version or versions(self.collections)
+            self._reset()
+            for name, description in Control.objects.values_list('name', 'description').iterator(chunk_size=SEARCH_BUILD_CHUNK_SIZE):
+                self._add(name, description)
+            self.sorted_names.sort()
+            self._version = version
+            self._built = True
+
+    def _ensure_built(self):
+        version = versions(self.collections)
+        if not self._built or version != self._version:
+            self.build(version)
+
+    # Apply a committed write of this process that moved the Control version to version. Every
+    # write bumps it by one, so unless the index is at the version right before, another worker
+    # wrote in between and the index is left for the next search to rebuild.
+    def apply(self, version, added=(), removed=()):
+        added = dict(added)
+        with self._lock:
+            if not self._built or self._version != {collection: number - 1 for collection, number in version.items()}:
+                return
+            for name in set(removed) | set(added):
+                self._remove(name)
+            for name, description in added.items():
+                self._add(name, description)
+            # The new names were appended to the sorted list; sorting merges them in one pass.
+            self.sorted_names.sort()
+            self._version = version
+
+    # Callers sort sorted_names once they are done adding.
+    def _add(self, name, description):
+        key = (name.lower(), name)
+        self.sorted_names.append(key)
+        self.display_names[name] = key
+        tokens = Counter(tokenize(description))
+        for token, count in tokens.items():
+            self.postings[token][name] = 1 + math.log(count)
+        self.document_tokens[name] = tokens
+
+    def _remove(self, name):
+        key = self.display_names.pop(name, None)
+        if key is not None:
+            index = bisect.bisect_left(self.sorted_names, key)
+            if index < len(self.sorted_names) and self.sorted_names[index] == key:
+                del self.sorted_names[index]
+        for token in self.document_tokens.pop(name, ()):
+            documents = self.postings.get(token)
+            if documents is not None:
+                documents.pop(name, None)
+                if not documents:
+                    del self.postings[token]
+
+    def _prefixed(self, prefix):
+        prefix = prefix.lower()
+        index = bisect.bisect_left(self.sorted_names, (prefix, ''))
+        names = []
+        while index < len(self.sorted_names) and self.sorted_names[index][0].startswith(prefix):
+            names.append(self.sorted_names[index][1])
+            index += 1
+        return names
+
+    # Rank controls by tf-idf over the description tokens. Every query token must be present;
+    # a name prefix restricts the candidates further. Returns RankedResults, best match first.
+    def search(self, query="", prefix=""):
+        with self._lock:
+            self._ensure_built()
+            tokens = list(dict.fromkeys(tokenize(query)))
+            if not tokens:
+                return [(name, 0.0) for name in self._prefixed(prefix)] if prefix else []
+            postings = sorted((self.postings.get(token, {}) for token in tokens), key=len)
+            if not postings[0]:
+                return []
+            matches = set(postings[0])
+            for documents in postings[1:]:
+                matches.intersection_update(documents)
+            if prefix:
+                matches.intersection_update(self._prefixed(prefix))
+            total = len(self.display_names)
+            weighted = [(documents, math.log(1 + total / len(documents))) for documents in postings]
+            return RankedResults({name: sum(documents[name] * idf for documents, idf in weighted) for name in matches})
+
+
+# Scored matches that are only ordered as far as a page needs: slicing [start:stop] selects the
+# best stop matches with a heap instead of sorting all of them.
+class RankedResults:
+    def __init__(self, scores):
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        stop = len(self.scores) if item.stop is None else item.stop
+        best = heapq.nsmallest(stop, self.scores.items(), key=lambda match: (-match[1], match[0]))
+        return best[item]
+
+
+control_search_index = ControlSearchIndex()
+
+
+# The version is read right after the write bumped it: cache.py connects its receivers first, and
+# the row lock of the update keeps other writers out until this transaction ends.
+def _index_on_commit(added=(), removed=()):
+    version = versions(control_search_index.collections)
+    transaction.on_commit(lambda: control_search_index.apply(version, added, removed))
+
+
+@receiver(post_save, sender=Control)
+def index_control(instance, **kwargs):
+    _index_on_commit(added=[(instance.name, instance.description)])
+
+
+@receiver(bulk_created, sender=Control)
+def index_controls(instances, **kwargs):
+    _index_on_commit(added=[(instance.name, instance.description) for instance in instances])
+
+
+@receiver(post_delete, sender=Control)
+def unindex_control(instance, **kwargs):
+    _index_on_commit(removed=[instance.name])
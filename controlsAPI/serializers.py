@@ -1,8 +1,21 @@
 from rest_framework import serializers
-from controlsAPI.models import Control, ControlHierarchy, ControlSet, ControlSetReference
+from controlsAPI.models import Control, ControlHierarchy, ControlSet, ControlSetReference, prefetch_edges
+from controlsAPI.closure import add_references, ancestor_slugs
+from controlsAPI.edges import set_children, set_parents
+from controlsAPI.repository import get_repository
 from django.core.validators import RegexValidator, MinValueValidator
-
-class ControlModelSerializer(serializers.ModelSerializer):
+from django.db.models import Q
+
+# Serializers taking fields=[...] only keep those fields, for the ?fields= query parameter.
+class DynamicFieldsMixin:
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+class ControlModelSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     name = serializers.CharField(max_length=None, validators=[RegexValidator(regex='^[a-zA-Z\s]*$', message='Name must only contain alphabetic characters', code='invalid_name')])
     description = serializers.CharField(max_length=None)
     
@@ -30,7 +43,7 @@ class ControlsetModelSerializer(serializers.ModelSerializer):
 class ListField(serializers.ListField):
     child = serializers.CharField()
 
-class ControlHierarchyModelSerializer(serializers.ModelSerializer):
+class ControlHierarchyModelSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     control_set = ControlsetReferenceModelSerializer(many=True, required=False)
     parents = ListField(default=[], allow_empty=True)
     children = ListField(default=[], allow_empty=True)
@@ -40,33 +53,37 @@ class ControlHierarchyModelSerializer(serializers.ModelSerializer):
         fields = "__all__"
     
     # Custom validation for parents and children using hierarchy depth.
+    # The current ControlSet and every name in the request are loaded with one query.
     def validate(self, attrs):
         parent_value = attrs.get('parents', [])
         children_value = attrs.get('children', [])
-        existing_controlset_names = set(ControlSet.objects.values_list('name', flat=True))
-        slug = self.instance.slug if self.instance else None
+        slug = str(self.instance.slug) if self.instance else None
+        query = Q(name__in=set(parent_value) | set(children_value))
         if slug:
-            try:
-                control_set_instance = ControlSet.objects.get(slug=slug)
-                hierarchical_depth = control_set_instance.hierarchy_depth
-            except ControlSet.DoesNotExist:
-                hierarchical_depth = None
+            query |= Q(slug=slug)
+        depths = {}
+        hierarchical_depth = None
+        for control_set_slug, name, hierarchy_depth in ControlSet.objects.filter(query).values_list('slug', 'name', 'hierarchy_depth'):
+            depths[name] = hierarchy_depth
+            if str(control_set_slug) == slug:
+                self.control_set_name = name
+                hierarchical_depth = hierarchy_depth
+        if slug and hierarchical_depth is None:
+            raise serializers.ValidationError(f"No ControlSet found with slug {slug}")
 
         if hierarchical_depth == 0 and len(parent_value)>0:
             raise serializers.ValidationError("Parents do not exist")
 
         for parent_name in parent_value:
-            if parent_name not in existing_controlset_names:
+            if parent_name not in depths:
                 raise serializers.ValidationError(f"Parent ControlSet '{parent_name}' does not exist.")
-            parent_instance = ControlSet.objects.get(name=parent_name)
-            if parent_instance.hierarchy_depth >= hierarchical_depth:
+            if depths[parent_name] >= hierarchical_depth:
                 raise serializers.ValidationError(f"Parent ControlSet '{parent_name}' has greater hierarchy depth than the current ControlSet(It can't be a parent).")
 
         for child_name in children_value:
-            if child_name not in existing_controlset_names:
+            if child_name not in depths:
                 raise serializers.ValidationError(f"Child ControlSet '{child_name}' does not exist.")
-            child_instance = ControlSet.objects.get(name=child_name)
-            if child_instance.hierarchy_depth <= hierarchical_depth:
+            if depths[child_name] <= hierarchical_depth:
                 raise serializers.ValidationError(f"Child ControlSet '{child_name}' has lesser hierarchy depth than the current ControlSet(It can't be a child).")
 
         return attrs
@@ -74,40 +91,24 @@ class ControlHierarchyModelSerializer(serializers.ModelSerializer):
     # Update the control_set in ControlHierarchy instance with validated data.
     def update(self, instance, validated_data):
         control_set_data = validated_data.pop('control_set', None)
+        control_set_instances = []
         if control_set_data:
-            control_set_instances = []
+            reference_names = get_repository().reference_names(data.get('reference_id') for data in control_set_data)
             for data in control_set_data:
                 reference_id = data.get('reference_id')
-                try:
-                    control_set_instance = ControlSetReference.objects.get(reference_id=reference_id)
-                    control_set_instances.append(control_set_instance)
-                except ControlSetReference.DoesNotExist:
+                if reference_id not in reference_names:
                     raise serializers.ValidationError(f"ControlSetReference {reference_id} does not exist")
-            instance.control_set.add(*control_set_instances)
+                control_set_instances.append(ControlSetReference(name=reference_names[reference_id], reference_id=reference_id))
+            instance.control_set.add(*(control_set_instance.pk for control_set_instance in control_set_instances))
             
-        parents = validated_data.get('parents', [])
-        instance.parents = parents  
-
-        children = validated_data.get('children', [])
-        instance.children = children  
-        
-        instance.save()
-
-        for parent_name in parents:
-            try:
-                parent_control_set = ControlSet.objects.get(name=parent_name)
-                control_set_slug = parent_control_set.slug
-                parent_instance = ControlHierarchy.objects.get(slug=control_set_slug)
-            except ControlSet.DoesNotExist:
-                raise serializers.ValidationError(f"Parent ControlSet '{parent_name}' does not exist.")
-            except ControlHierarchy.DoesNotExist:
-                raise serializers.ValidationError(f"No ControlHierarchy found with slug {control_set_slug}")
-            parent_instance.control_set.add(*control_set_instances)
-            parent_instance.save()
+        # Only the lists sent in the request are replaced. Writing the edges refreshes the
+        # HierarchyClosure rows, so the new references reach every ancestor in one write.
+        name = getattr(self, 'control_set_name', None) or ControlSet.objects.values_list('name', flat=True).get(slug=instance.slug)
+        if 'parents' in validated_data:
+            set_parents(name, validated_data['parents'])
+        if 'children' in validated_data:
+            set_children(name, validated_data['children'])
+        prefetch_edges([instance])
+        if control_set_instances:
+            add_references(ancestor_slugs(instance.slug), control_set_instances)
         return instance
-        
-
-
-
-        
-
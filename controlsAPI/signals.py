@@ -0,0 +1,14 @@
+from django.dispatch import Signal
+
+# Sent with sender=HierarchyEdge after edges are written in bulk, with the added and removed
+# (parent, child) ControlSet name pairs. Bulk writes skip post_save/post_delete, so the indexes listen here.
+edges_changed = Signal()
+
+# Sent with sender=<model> after rows are inserted with bulk_create, which does not send post_save.
+bulk_created = Signal()
+
+# Sent with sender=<model> after rows are changed or removed with queryset update()/delete(),
+# bulk_update() or direct writes to a ManyToMany through table, none of which send per-row signals.
+# Writes to the ControlHierarchy through table pass the affected hierarchy slugs as slugs=[...],
+# ControlSetReference updates pass the names of the updated references as names=[...].
+bulk_changed = Signal()
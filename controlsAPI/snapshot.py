@@ -0,0 +1,210 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from .changelog import log_state, settled_sequence
+from .export import EXPORT_CHUNK_SIZE, iter_chunks
+from .fieldsets import hierarchy_data
+from .middleware import compress
+from .models import Control, ControlHierarchy, ControlSet, ControlSetReference, HierarchyEdge
+from .renderers import FastJSONRenderer
+from .signals import bulk_changed, bulk_created, edges_changed
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'CTLSNAP1'
+SNAPSHOT_CHUNK_SIZE = 64 * 1024
+# Offset of the index, then the magic, at the very end of the file.
+_FOOTER = struct.Struct('<Q8s')
+
+
+def snapshot_path():
+    return str(getattr(settings, 'CONTROLS_API_SNAPSHOT_PATH', os.path.join(settings.BASE_DIR, 'catalog.snapshot')))
+
+
+# Write every resolved ControlHierarchy, as controlhierarchies_details returns it, to one file:
+# a JSON array of all of them, a JSON index of the byte ranges of the array and of each entry in
+# it by slug, and a fixed-size footer pointing at the index. The file is written next to the old
+# one and renamed over it, so readers never see half a snapshot. The state of the change log is
+# read first: a change committed while building, or later, leaves the snapshot stale. It is taken
+# after the settled sequence, below which no late commit can appear any more.
+def build_snapshot(path=None, chunk_size=EXPORT_CHUNK_SIZE):
+    path = path or snapshot_path()
+    settled = settled_sequence()
+    logged, sequence = log_state(settled)
+    renderer = FastJSONRenderer()
+    hierarchies = {}
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'wb') as snapshot_file:
+        snapshot_file.write(b'[')
+        offset, count = 1, 0
+        queryset = ControlHierarchy.objects.prefetch_related('control_set').order_by('slug')
+        for chunk in iter_chunks(queryset, chunk_size):
+            for data in hierarchy_data(chunk):
+                content = renderer.render(data)
+                if count:
+                    snapshot_file.write(b',')
+                    offset += 1
+                snapshot_file.write(content)
+                hierarchies[data['slug']] = [offset, len(content)]
+                offset += len(content)
+                count += 1
+        snapshot_file.write(b']')
+        index = {'sequence': sequence, 'log': [settled, logged], 'count': count, 'catalog': [0, offset + 1], 'hierarchies': hierarchies}
+        snapshot_file.write(renderer.render(index))
+        snapshot_file.write(_FOOTER.pack(offset + 1, SNAPSHOT_MAGIC))
+    os.replace(temporary_path, path)
+    return index
+
+
+class SnapshotError(Exception):
+    pass
+
+
+# A snapshot file mapped read-only. Reads return memoryview slices of the mapping, so nothing is
+# copied until the response is written.
+class CatalogSnapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        if len(self._view) < _FOOTER.size:
+            raise SnapshotError(f"{path} is too short to be a catalog snapshot")
+        index_offset, magic = _FOOTER.unpack(self._view[-_FOOTER.size:])
+        if magic != SNAPSHOT_MAGIC:
+            raise SnapshotError(f"{path} is not a catalog snapshot")
+        index = json.loads(bytes(self._view[index_offset:-_FOOTER.size]))
+        self.sequence = index['sequence']
+        self.settled, self.logged = index['log']
+        self.count = index['count']
+        self._catalog = index['catalog']
+        self._hierarchies = index['hierarchies']
+        self._compressed_lock = threading.Lock()
+        self._compressed = {}
+
+    def _slice(self, offset, length):
+        return self._view[offset:offset + length]
+
+    def catalog(self):
+        return self._slice(*self._catalog)
+
+    def hierarchy(self, slug):
+        entry = self._hierarchies.get(str(slug))
+        return None if entry is None else self._slice(*entry)
+
+    # The catalog compressed with the given encoding, compressed on first use and kept for as long
+    # as this snapshot is mapped.
+    def compressed_catalog(self, encoding):
+        with self._compressed_lock:
+            if encoding not in self._compressed:
+                self._compressed[encoding] = compress(self.catalog(), encoding)
+            return self._compressed[encoding]
+
+
+# The snapshot of this process, mapped again whenever the file on disk is replaced.
+class SnapshotStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._file_key = None
+
+    def get(self):
+        path = snapshot_path()
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        file_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if file_key != self._file_key:
+                try:
+                    self._snapshot = CatalogSnapshot(path)
+                except (OSError, ValueError, SnapshotError):
+                    logger.exception("Could not read the catalog snapshot %s", path)
+                    self._snapshot = None
+                self._file_key = file_key
+            return self._snapshot
+
+    # A snapshot is current while the change log after its settled sequence is as it was when it
+    # was built.
+    def fresh(self):
+        snapshot = self.get()
+        if snapshot is not None and log_state(snapshot.settled) == (snapshot.logged, snapshot.sequence):
+            return snapshot
+        return None
+
+
+snapshot_store = SnapshotStore()
+
+
+# (start, stop) of a single-range "bytes=first-last", "bytes=first-" or "bytes=-suffix" Range
+# header over a body of the given length; None without one. Unsatisfiable ranges raise ValueError.
+def byte_range(header, length):
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    if not first:
+        suffix = int(last)
+        if suffix <= 0:
+            raise ValueError(header)
+        return max(length - suffix, 0), length
+    start = int(first)
+    stop = min(int(last) + 1, length) if last else length
+    if start >= length or stop <= start:
+        raise ValueError(header)
+    return start, stop
+
+
+# Chunks of a slice of the mapped snapshot, for a streaming response that never holds the whole
+# body in memory.
+def iter_slices(body, chunk_size=SNAPSHOT_CHUNK_SIZE):
+    for start in range(0, len(body), chunk_size):
+        yield body[start:start + chunk_size]
+
+
+_rebuild_lock = threading.Lock()
+_rebuild_timer = None
+
+
+def _rebuild():
+    global _rebuild_timer
+    with _rebuild_lock:
+        _rebuild_timer = None
+    try:
+        build_snapshot()
+    except Exception:
+        logger.exception("Background rebuild of the catalog snapshot failed")
+    finally:
+        connection.close()
+
+
+# With CONTROLS_API_SNAPSHOT_REBUILD_DELAY set, committed writes rebuild the snapshot in a
+# background thread that many writes within the delay share.
+def schedule_rebuild(**kwargs):
+    global _rebuild_timer
+    delay = getattr(settings, 'CONTROLS_API_SNAPSHOT_REBUILD_DELAY', None)
+    if delay is None:
+        return
+    with _rebuild_lock:
+        if _rebuild_timer is None:
+            _rebuild_timer = threading.Timer(delay, _rebuild)
+            _rebuild_timer.daemon = True
+            _rebuild_timer.start()
+
+
+def _schedule_rebuild_on_commit(**kwargs):
+    transaction.on_commit(schedule_rebuild)
+
+
+for model in (Control, ControlSet, ControlSetReference, ControlHierarchy, HierarchyEdge):
+    post_save.connect(_schedule_rebuild_on_commit, sender=model, dispatch_uid=f"controlsapi_snapshot_save_{model._meta.model_name}")
+    post_delete.connect(_schedule_rebuild_on_commit, sender=model, dispatch_uid=f"controlsapi_snapshot_delete_{model._meta.model_name}")
+m2m_changed.connect(_schedule_rebuild_on_commit, sender=ControlHierarchy.control_set.through, dispatch_uid="controlsapi_snapshot_m2m")
+bulk_created.connect(_schedule_rebuild_on_commit, dispatch_uid="controlsapi_snapshot_bulk_created")
+bulk_changed.connect(_schedule_rebuild_on_commit, dispatch_uid="controlsapi_snapshot_bulk_changed")
+edges_changed.connect(_schedule_rebuild_on_commit, dispatch_uid="controlsapi_snapshot_edges")
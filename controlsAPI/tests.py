@@ -1,3 +1,850 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import tempfile
+from datetime import timedelta
+from collections import Counter
+from io import StringIO
+from unittest import mock
+import brotli
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.db.models.deletion import Collector
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase, APITransactionTestCase
+from .cache import LRUMemoryCache, bump_versions, response_cache, versions
+from .fieldsets import hierarchy_data
+from .changelog import CHANGES_GAP_TIMEOUT, latest_sequence
+from .coverage import CoverageIndex
+from .effective import effective_reference_names
+from .graph import HierarchyGraph
+from .importer import import_file, read_checkpoint
+from .management.commands.migrate_hierarchy_edges import split_names
+from .middleware import choose_encoding, compress
+from .models import ChangeLogEntry, Control, ControlHierarchy, ControlSet, ControlSetReference, EffectiveControls, HierarchyClosure, HierarchyEdge
+from .pagination import KeysetPagination
+from .renderers import FastJSONRenderer
+from .repository import MongoRepository, get_repository, orm_repository
+from .search import control_search_index
+from .serializers import ControlHierarchyModelSerializer
+from .signals import edges_changed
+from .snapshot import build_snapshot
+from .tree import SUBTREE_MAX_DEPTH
 
-# Create your tests here.
+
+class LRUMemoryCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = LRUMemoryCache('controlsapi-tests', {'OPTIONS': {'MAX_BYTES': 1024}})
+        self.cache.clear()
+
+    def test_clear_drops_entries_and_usage(self):
+        self.cache.set('a', 'x' * 100)
+        self.cache.set('b', 'y' * 100)
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache._usage['bytes'], 0)
+        self.cache.set('c', 'z')
+        self.assertEqual(self.cache.get('c'), 'z')
+
+    def test_evicts_least_recently_used_over_max_bytes(self):
+        for key in 'abcdef':
+            self.cache.set(key, key * 300)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('f'), 'f' * 300)
+        self.assertLessEqual(self.cache._usage['bytes'], 1024)
+
+
+def seed_catalog(client):
+    for name in ('Alpha', 'Beta', 'Gamma'):
+        client.post('/control_create/', {'name': name, 'description': f"{name} desc"}, format='json')
+        client.put('/controlsetreference_update/', {'name': name, 'reference_id': f"{name[0]}1"}, format='json')
+    for name, depth in (('Root', 0), ('Mid', 1), ('Other', 1), ('Leaf', 2)):
+        client.post('/controlset_create/', {'name': name, 'hierarchy_depth': depth}, format='json')
+    client.put('/controlhierarchies_update/', {'name': 'Mid', 'parents': ['Root'], 'children': ['Leaf']}, format='json')
+    client.put('/controlhierarchies_update/', {'name': 'Other', 'parents': ['Root'], 'children': ['Leaf']}, format='json')
+
+
+class ControlHierarchyTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+        self.slugs = dict(ControlSet.objects.values_list('name', 'slug'))
+
+    def references(self, name):
+        response = self.client.get('/controlhierarchies_details/', {'name': name})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(reference['name'] for reference in response.json()['control_set'])
+
+    def ancestors(self, name):
+        rows = HierarchyClosure.objects.filter(descendant=str(self.slugs[name])).values_list('ancestor', 'depth')
+        names = {str(slug): control_set for control_set, slug in self.slugs.items()}
+        return {names[ancestor]: depth for ancestor, depth in rows}
+
+    def test_closure_holds_every_ancestor(self):
+        self.assertEqual(self.ancestors('Leaf'), {'Mid': 1, 'Other': 1, 'Root': 2})
+        self.assertEqual(self.ancestors('Root'), {})
+
+    def test_reference_propagates_to_and_is_removed_from_ancestors(self):
+        response = self.client.put('/controlhierarchies_update/', {'name': 'Leaf', 'control_set': [{'reference_id': 'G1', 'name': 'Gamma'}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for name in ('Leaf', 'Mid', 'Other', 'Root'):
+            self.assertEqual(self.references(name), ['Gamma'])
+
+        response = self.client.delete('/controlhierarchies_controlsetdelete/', {'name': 'Leaf', 'reference_id': 'G1'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for name in ('Leaf', 'Mid', 'Other', 'Root'):
+            self.assertEqual(self.references(name), [])
+
+    def test_control_set_delete_updates_closure(self):
+        response = self.client.delete('/controlset_delete/', {'name': 'Mid'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.ancestors('Leaf'), {'Other': 1, 'Root': 2})
+        mid = str(self.slugs['Mid'])
+        self.assertFalse(HierarchyClosure.objects.filter(Q(ancestor=mid) | Q(descendant=mid)).exists())
+
+
+
+class ControlHierarchyDetailsTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+        self.client.put('/controlhierarchies_update/', {'name': 'Leaf', 'control_set': [{'reference_id': 'G1', 'name': 'Gamma'}]}, format='json')
+
+    def test_resolves_control_details(self):
+        response = self.client.get('/controlhierarchies_details/', {'name': 'Mid'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['control_set'], [{'name': 'Gamma', 'reference_id': 'G1', 'control_name': 'Gamma', 'description': 'Gamma desc'}])
+        self.assertEqual(response.json()['control_set_name'], 'Mid')
+
+    def test_list_queries_do_not_grow_with_hierarchies(self):
+        with CaptureQueriesContext(connection) as before:
+            self.client.get('/controlhierarchies_details/')
+        for name, depth in (('First', 3), ('Second', 3), ('Third', 3)):
+            self.client.post('/controlset_create/', {'name': name, 'hierarchy_depth': depth}, format='json')
+            self.client.put('/controlhierarchies_update/', {'name': name, 'parents': ['Leaf'], 'control_set': [{'reference_id': 'A1', 'name': 'Alpha'}]}, format='json')
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get('/controlhierarchies_details/')
+        self.assertEqual(len(response.json()['results']), 7)
+        self.assertEqual(len(after.captured_queries), len(before.captured_queries))
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+
+    def test_next_links_walk_every_row_once(self):
+        names = []
+        response = self.client.get('/control_details/', {'page_size': 2})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            page = response.json()
+            self.assertLessEqual(len(page['results']), 2)
+            names += [control['name'] for control in page['results']]
+            if not page['next']:
+                break
+            response = self.client.get(page['next'])
+        self.assertEqual(names, ['Alpha', 'Beta', 'Gamma'])
+
+    def test_page_size_is_capped(self):
+        self.assertEqual(KeysetPagination().get_page_size(Request(APIRequestFactory().get('/', {'page_size': 100000}))), 1000)
+
+
+class CatalogExportTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+
+    def records(self, response):
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_streams_every_record_as_ndjson(self):
+        response = self.client.get('/catalog_export/', {'chunk_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = self.records(response)
+        counts = Counter(record['type'] for record in records)
+        self.assertEqual(counts, {'control': 3, 'control_set_reference': 3, 'control_set': 4, 'control_hierarchy': 4})
+        self.assertEqual([record['data']['name'] for record in records if record['type'] == 'control'], ['Alpha', 'Beta', 'Gamma'])
+        leaf = next(record['data'] for record in records if record['type'] == 'control_hierarchy' and record['data']['control_set_name'] == 'Leaf')
+        self.assertEqual(leaf['parents'], ['Mid', 'Other'])
+
+    def test_chunk_size_does_not_change_the_output(self):
+        small = self.records(self.client.get('/catalog_export/', {'chunk_size': 1}))
+        large = self.records(self.client.get('/catalog_export/'))
+        self.assertEqual(small, large)
+
+    def test_rejects_invalid_chunk_size(self):
+        self.assertEqual(self.client.get('/catalog_export/', {'chunk_size': 0}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/catalog_export/', {'chunk_size': 'many'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class HierarchyGraphTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+
+    def test_ancestors_descendants_and_path(self):
+        response = self.client.get('/controlset_ancestors/', {'name': 'Leaf'})
+        self.assertEqual(sorted((item['name'], item['distance']) for item in response.json()['ancestors']), [('Mid', 1), ('Other', 1), ('Root', 2)])
+        response = self.client.get('/controlset_descendants/', {'name': 'Root'})
+        self.assertEqual(sorted((item['name'], item['distance']) for item in response.json()['descendants']), [('Leaf', 2), ('Mid', 1), ('Other', 1)])
+        response = self.client.get('/controlset_path/', {'source': 'Leaf', 'target': 'Root'})
+        self.assertIn(response.json()['path'], (['Leaf', 'Mid', 'Root'], ['Leaf', 'Other', 'Root']))
+        self.assertEqual(self.client.get('/controlset_path/', {'source': 'Mid', 'target': 'Other'}).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/controlset_ancestors/', {'name': 'Missing'}).status_code, status.HTTP_404_NOT_FOUND)
+
+    # A graph built earlier stands in for the index of another worker, which sees none of this process's writes.
+    def test_rebuilds_when_another_worker_writes(self):
+        graph = HierarchyGraph()
+        self.assertEqual(sorted(name for name, distance in graph.ancestors('Leaf')), ['Mid', 'Other', 'Root'])
+        self.client.post('/controlset_create/', {'name': 'Bottom', 'hierarchy_depth': 3}, format='json')
+        self.client.put('/controlhierarchies_update/', {'name': 'Bottom', 'parents': ['Leaf']}, format='json')
+        self.client.delete('/controlset_delete/', {'name': 'Other'}, format='json')
+        self.assertIn('Bottom', graph)
+        self.assertEqual(sorted(name for name, distance in graph.ancestors('Bottom')), ['Leaf', 'Mid', 'Root'])
+        self.assertNotIn('Other', graph)
+
+
+class ControlSetDeleteTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+
+    def edges(self, name):
+        response = self.client.get('/controlhierarchies_details/', {'name': name, 'fields': 'parents,children'})
+        return response.json()['parents'], response.json()['children']
+
+    def test_delete_removes_name_from_neighbours_only(self):
+        response = self.client.delete('/controlset_delete/', {'name': 'Mid'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.edges('Root'), ([], ['Other']))
+        self.assertEqual(self.edges('Leaf'), (['Other'], []))
+        self.assertEqual(self.edges('Other'), (['Root'], ['Leaf']))
+        self.assertFalse(ControlSet.objects.filter(name='Mid').exists())
+        self.assertEqual(self.client.get('/controlhierarchies_details/', {'name': 'Mid'}).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_unknown_control_set(self):
+        response = self.client.delete('/controlset_delete/', {'name': 'Missing'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(HierarchyEdge.objects.count(), 4)
+
+
+class HierarchyEdgeTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+
+    def test_update_writes_only_the_difference(self):
+        changes = []
+        receiver = lambda added, removed, **kwargs: changes.append((sorted(added), sorted(removed)))
+        edges_changed.connect(receiver, sender=HierarchyEdge)
+        self.addCleanup(edges_changed.disconnect, receiver, sender=HierarchyEdge)
+        kept = HierarchyEdge.objects.get(parent_id='Other', child_id='Leaf').pk
+        response = self.client.put('/controlhierarchies_update/', {'name': 'Leaf', 'parents': ['Other', 'Other']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['parents'], ['Other'])
+        self.assertEqual(changes, [([], [('Mid', 'Leaf')])])
+        self.assertEqual(list(HierarchyEdge.objects.filter(child_id='Leaf').values_list('pk', flat=True)), [kept])
+
+    def test_rebuilt_closure_matches_incremental_one(self):
+        incremental = set(HierarchyClosure.objects.values_list('ancestor', 'descendant', 'depth'))
+        call_command('rebuild_hierarchy_indexes', stdout=StringIO())
+        self.assertEqual(set(HierarchyClosure.objects.values_list('ancestor', 'descendant', 'depth')), incremental)
+
+    def test_split_legacy_names(self):
+        self.assertEqual(split_names("Root,Mid"), ['Root', 'Mid'])
+        self.assertEqual(split_names("None"), [])
+        self.assertEqual(split_names(['Root', '']), ['Root'])
+
+
+class BulkCreateTests(APITestCase):
+    def test_creates_controls_with_their_references(self):
+        response = self.client.post('/control_bulk_create/', [{'name': 'Alpha', 'description': 'a'}, {'name': 'Beta', 'description': 'b'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([control['name'] for control in response.json()['created']], ['Alpha', 'Beta'])
+        self.assertEqual(sorted(ControlSetReference.objects.values_list('name', flat=True)), ['Alpha', 'Beta'])
+
+    def test_reports_invalid_and_duplicate_items(self):
+        self.client.post('/control_create/', {'name': 'Alpha', 'description': 'a'}, format='json')
+        items = [{'name': 'Alpha', 'description': 'a'}, {'name': 'Beta', 'description': 'b'}, {'name': 'Beta', 'description': 'c'}, {'name': 'B3ta'}]
+        response = self.client.post('/control_bulk_create/', items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [0, 2, 3])
+        self.assertEqual(Control.objects.get(name='Beta').description, 'b')
+
+    def test_nothing_created(self):
+        response = self.client.post('/controlset_bulk_create/', [{'name': 'Root'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post('/controlset_bulk_create/', {'name': 'Root'}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_creates_control_sets_with_their_hierarchies(self):
+        response = self.client.post('/controlset_bulk_create/', [{'name': 'Root', 'hierarchy_depth': 0}, {'name': 'Mid', 'hierarchy_depth': 1}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        slugs = {control_set['slug'] for control_set in response.json()['created']}
+        self.assertEqual({str(slug) for slug in ControlHierarchy.objects.values_list('slug', flat=True)}, slugs)
+        response = self.client.put('/controlhierarchies_update/', {'name': 'Mid', 'parents': ['Root']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ImportTests(APITestCase):
+    records = [
+        {'type': 'control', 'name': 'Alpha', 'description': 'a'},
+        {'type': 'control', 'name': 'Beta', 'description': 'b'},
+        {'type': 'control_set', 'name': 'Root', 'hierarchy_depth': 0},
+        {'type': 'control_set', 'name': 'Leaf', 'hierarchy_depth': 1},
+        {'type': 'reference', 'name': 'Alpha', 'reference_id': 'A1'},
+        {'type': 'edge', 'parent': 'Root', 'child': 'Leaf'},
+        {'type': 'assignment', 'control_set': 'Leaf', 'reference_id': 'A1'},
+        {'type': 'edge', 'parent': 'Leaf', 'child': 'Root'},
+    ]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'catalog.jsonl')
+        with open(self.path, 'w', encoding='utf-8') as catalog_file:
+            catalog_file.writelines(json.dumps(record) + '\n' for record in self.records)
+        self.checkpoint_path = self.path + '.checkpoint'
+
+    def assert_imported(self):
+        self.assertEqual(sorted(Control.objects.values_list('name', flat=True)), ['Alpha', 'Beta'])
+        self.assertEqual(list(HierarchyEdge.objects.values_list('parent_id', 'child_id')), [('Root', 'Leaf')])
+        root, leaf = (ControlSet.objects.get(name=name).slug for name in ('Root', 'Leaf'))
+        through = ControlHierarchy.control_set.through
+        self.assertEqual(set(through.objects.values_list('controlhierarchy_id', 'controlsetreference_id')), {(str(root), 'Alpha'), (str(leaf), 'Alpha')})
+
+    def test_resumes_after_the_last_committed_batch(self):
+        batches = import_file(self.path, batch_size=3, checkpoint_path=self.checkpoint_path)
+        next(batches)
+        self.assertEqual(read_checkpoint(self.checkpoint_path), 3)
+        stats = list(import_file(self.path, batch_size=3, checkpoint_path=self.checkpoint_path))[-1]
+        self.assertEqual(stats['records'], 8)
+        self.assertEqual(stats['processed'], 5)
+        self.assertEqual(len(stats['errors']), 1)
+        self.assert_imported()
+
+    def test_command_imports_and_reports_rejected_records(self):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_controls', self.path, batch_size=2, stdout=stdout, stderr=stderr)
+        self.assert_imported()
+        self.assertIn("1 rejected", stdout.getvalue())
+        self.assertIn("greater hierarchy depth", stderr.getvalue())
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+
+class ControlHierarchyValidationTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+        self.serializer = ControlHierarchyModelSerializer(ControlHierarchy.objects.get(slug=ControlSet.objects.get(name='Mid').slug), partial=True)
+
+    def test_validates_with_one_query(self):
+        with self.assertNumQueries(1):
+            self.serializer.validate({'parents': ['Root'], 'children': ['Leaf']})
+
+    def test_rejects_invalid_depths_and_unknown_names(self):
+        for attrs, message in (
+            ({'parents': ['Leaf']}, "Parent ControlSet 'Leaf' has greater hierarchy depth"),
+            ({'parents': ['Other']}, "Parent ControlSet 'Other' has greater hierarchy depth"),
+            ({'children': ['Root']}, "Child ControlSet 'Root' has lesser hierarchy depth"),
+            ({'parents': ['Missing']}, "Parent ControlSet 'Missing' does not exist."),
+            ({'children': ['Missing']}, "Child ControlSet 'Missing' does not exist."),
+        ):
+            with self.assertRaisesMessage(ValidationError, message):
+                self.serializer.validate(attrs)
+
+    def test_root_cannot_have_parents(self):
+        response = self.client.put('/controlhierarchies_update/', {'name': 'Root', 'parents': ['Mid']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'non_field_errors': ['Parents do not exist']})
+
+
+# Responses are not cached inside a transaction, so this case commits its writes.
+class ConditionalRequestTests(APITransactionTestCase):
+    def setUp(self):
+        response_cache().clear()
+        seed_catalog(self.client)
+
+    def test_not_modified_until_written(self):
+        response = self.client.get('/control_details/', {'name': 'Beta'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        response = self.client.get('/control_details/', {'name': 'Beta'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.put('/control_update/', {'name': 'Beta', 'description': 'Changed'}, format='json')
+        response = self.client.get('/control_details/', {'name': 'Beta'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['description'], 'Changed')
+
+    def test_membership_change_bumps_the_version_once(self):
+        hierarchy = ControlHierarchy.objects.get(slug=ControlSet.objects.get(name='Leaf').slug)
+        before = versions(['controlhierarchy'])['controlhierarchy']
+        hierarchy.control_set.add('Alpha')
+        self.assertEqual(versions(['controlhierarchy'])['controlhierarchy'], before + 1)
+
+
+# The async views query on a thread pool with its own connections, which only see committed rows.
+class AsyncViewTests(APITransactionTestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+        self.client.put('/controlhierarchies_update/', {'name': 'Leaf', 'control_set': [{'reference_id': 'G1', 'name': 'Gamma'}]}, format='json')
+
+    def test_match_the_sync_views(self):
+        for path, params in (
+            ('controlhierarchies_details/', {}),
+            ('controlhierarchies_details/', {'name': 'Mid'}),
+            ('control_details/', {'page_size': 2}),
+            ('controlset_details/', {'name': 'Leaf'}),
+            ('controlsetreference_details/', {'name': 'Gamma'}),
+        ):
+            sync_response = self.client.get('/' + path, params)
+            async_response = self.client.get('/async/' + path, params)
+            self.assertEqual(async_response.status_code, status.HTTP_200_OK)
+            # Page links point back at the view that served them.
+            sync_data, async_data = sync_response.json(), async_response.json()
+            self.assertEqual(async_data.get('results', async_data), sync_data.get('results', sync_data))
+
+    def test_not_found(self):
+        self.assertEqual(self.client.get('/async/controlhierarchies_details/', {'name': 'Missing'}).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/async/control_details/', {'name': 'Missing'}).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RepositoryTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+        self.client.put('/controlhierarchies_update/', {'name': 'Leaf', 'control_set': [{'reference_id': 'G1', 'name': 'Gamma'}, {'reference_id': 'A1', 'name': 'Alpha'}]}, format='json')
+        self.client.put('/controlsetreference_update/', {'name': 'Beta', 'reference_id': 'G1'}, format='json')
+
+    def test_orm_is_the_default_backend(self):
+        self.assertIs(get_repository(), orm_repository)
+        with override_settings(CONTROLS_API_READ_BACKEND='mongo'):
+            self.assertIs(get_repository(), orm_repository)
+
+    def test_orm_details_match_the_details_endpoint(self):
+        control_set, details = orm_repository.hierarchy_details('Mid')
+        self.assertEqual(control_set['name'], 'Mid')
+        self.assertEqual(details, hierarchy_data([ControlHierarchy.objects.get(slug=control_set['slug'])])[0])
+        self.assertEqual(orm_repository.hierarchy_details('Missing'), (None, None))
+
+    # What the $lookup pipeline returns for a control set, built here from the same rows.
+    def aggregation_document(self, name):
+        control_set = ControlSet.objects.values('slug', 'name', 'hierarchy_depth').get(name=name)
+        through = ControlHierarchy.control_set.through
+        links = list(through.objects.filter(controlhierarchy_id=control_set['slug']).values('controlsetreference_id'))
+        references = list(ControlSetReference.objects.filter(name__in=[link['controlsetreference_id'] for link in links]).values('name', 'reference_id'))
+        resolved = list(ControlSetReference.objects.filter(reference_id__in=[reference['reference_id'] for reference in references]).values('reference_id', 'name'))
+        return {
+            **control_set,
+            'hierarchy': [{'slug': control_set['slug']}],
+            'links': links,
+            'references': references,
+            'resolved': resolved,
+            'controls': list(Control.objects.filter(name__in=[reference['name'] for reference in resolved]).values('name', 'description')),
+            'parent_edges': list(HierarchyEdge.objects.filter(child_id=name).values('id', 'parent_id')),
+            'child_edges': list(HierarchyEdge.objects.filter(parent_id=name).values('id', 'child_id')),
+        }
+
+    def test_mongo_document_is_shaped_like_the_orm_details(self):
+        for name in ('Root', 'Mid', 'Leaf'):
+            control_set, details = orm_repository.hierarchy_details(name)
+            self.assertEqual(MongoRepository()._hierarchy_data(self.aggregation_document(name)), details)
+
+
+
+class ControlSetReferenceBulkUpdateTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+
+    def test_mapping_swaps_reference_ids(self):
+        response = self.client.put('/controlsetreference_bulk_update/', {'mapping': {'A1': 'B1', 'B1': 'A1', 'X1': 'Y1'}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'updated': {'A1': 1, 'B1': 1, 'X1': 0}, 'unknown': ['X1']})
+        reference_ids = dict(ControlSetReference.objects.values_list('name', 'reference_id'))
+        self.assertEqual(reference_ids, {'Alpha': 'B1', 'Beta': 'A1', 'Gamma': 'G1'})
+
+    def test_unknown_ids_change_nothing(self):
+        before = versions(['controlsetreference'])
+        response = self.client.put('/controlsetreference_bulk_update/', {'mapping': {'X1': 'Y1'}}, format='json')
+        self.assertEqual(response.json(), {'updated': {'X1': 0}, 'unknown': ['X1']})
+        self.assertEqual(versions(['controlsetreference']), before)
+
+    def test_single_update_moves_every_reference_sharing_the_id(self):
+        self.client.put('/controlsetreference_update/', {'name': 'Beta', 'reference_id': 'A1'}, format='json')
+        response = self.client.put('/controlsetreference_update/', {'name': 'Alpha', 'reference_id': 'N1'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        reference_ids = dict(ControlSetReference.objects.values_list('name', 'reference_id'))
+        self.assertEqual(reference_ids, {'Alpha': 'N1', 'Beta': 'N1', 'Gamma': 'G1'})
+
+
+class ControlDeleteTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+        self.client.put('/controlhierarchies_update/', {'name': 'Leaf', 'control_set': [{'reference_id': 'G1', 'name': 'Gamma'}]}, format='json')
+
+    def test_dry_run_deletes_nothing(self):
+        response = self.client.delete('/control_delete/', {'name': 'Gamma', 'dry_run': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.json()['dry_run'])
+        self.assertEqual(response.json()['references'], ['Gamma'])
+        self.assertEqual(len(response.json()['hierarchies']), 4)
+        self.assertTrue(Control.objects.filter(name='Gamma').exists())
+        self.assertTrue(ControlSetReference.objects.filter(name='Gamma').exists())
+        self.assertEqual(ControlHierarchy.control_set.through.objects.filter(controlsetreference_id='Gamma').count(), 4)
+
+    def test_delete_matches_dry_run(self):
+        dry_run = self.client.delete('/control_delete/', {'name': 'Gamma', 'dry_run': True}, format='json').json()
+        response = self.client.delete('/control_delete/', {'name': 'Gamma'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['references'], dry_run['references'])
+        self.assertEqual(response.json()['hierarchies'], dry_run['hierarchies'])
+        self.assertFalse(Control.objects.filter(name='Gamma').exists())
+        self.assertFalse(ControlSetReference.objects.filter(name='Gamma').exists())
+        self.assertFalse(ControlHierarchy.control_set.through.objects.filter(controlsetreference_id='Gamma').exists())
+        self.assertEqual(ControlHierarchy.objects.count(), 4)
+
+    def test_unknown_control(self):
+        response = self.client.delete('/control_delete/', {'name': 'Missing', 'dry_run': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.delete('/control_delete/', {'name': 'Gamma', 'dry_run': 'yes'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BatchTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+
+    def test_operations_see_earlier_writes(self):
+        response = self.client.post('/batch/', [
+            {'method': 'GET', 'path': '/control_details/', 'body': {'name': 'Beta'}},
+            {'method': 'PUT', 'path': '/control_update/', 'body': {'name': 'Beta', 'description': 'Changed'}},
+            {'method': 'GET', 'path': '/control_details/', 'body': {'name': 'Beta'}},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        summary = response.json()
+        self.assertEqual((summary['atomic'], summary['committed'], summary['applied']), (True, True, 3))
+        self.assertEqual([result['body']['description'] for result in summary['results'][::2]], ['Beta desc', 'Changed'])
+
+    def test_failure_rolls_back_the_whole_batch(self):
+        response = self.client.post('/batch/', [
+            {'method': 'POST', 'path': '/control_create/', 'body': {'name': 'Delta', 'description': 'd'}},
+            {'method': 'PUT', 'path': '/control_update/', 'body': {'name': 'Alpha', 'description': 'Changed'}},
+            {'method': 'DELETE', 'path': '/controlset_delete/', 'body': {'name': 'Missing'}},
+            {'method': 'POST', 'path': '/control_create/', 'body': {'name': 'Epsilon', 'description': 'e'}},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        summary = response.json()
+        self.assertEqual((summary['atomic'], summary['committed'], summary['applied']), (True, False, 0))
+        self.assertEqual([result['status'] for result in summary['results']], [201, 200, 404])
+        self.assertFalse(Control.objects.filter(name__in=['Delta', 'Epsilon']).exists())
+        self.assertEqual(Control.objects.get(name='Alpha').description, 'Alpha desc')
+
+    def test_without_transactions_reports_the_applied_operations(self):
+        with mock.patch.object(connection.features, 'supports_transactions', False):
+            response = self.client.post('/batch/', [
+                {'method': 'POST', 'path': '/control_create/', 'body': {'name': 'Delta', 'description': 'd'}},
+                {'method': 'DELETE', 'path': '/controlset_delete/', 'body': {'name': 'Missing'}},
+            ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        summary = response.json()
+        self.assertEqual((summary['atomic'], summary['committed'], summary['applied']), (False, False, 1))
+        self.assertIn("not rolled back", summary['msg'])
+        self.assertTrue(Control.objects.filter(name='Delta').exists())
+
+    def test_rejects_malformed_batches(self):
+        for operations in ([], [{'method': 'GET', 'path': '/missing/'}], [{'method': 'GET', 'path': '/catalog_export/'}], [{'method': 'TRACE', 'path': '/control_details/'}]):
+            response = self.client.post('/batch/', operations, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_index_tables_keep_fast_deletes(self):
+        for model in (HierarchyClosure, EffectiveControls, ChangeLogEntry, ControlHierarchy.control_set.through):
+            self.assertTrue(Collector(using='default').can_fast_delete(model.objects.all()), model.__name__)
+
+
+class FieldsetTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+        self.client.put('/controlhierarchies_update/', {'name': 'Leaf', 'control_set': [{'reference_id': 'G1', 'name': 'Gamma'}]}, format='json')
+
+    def test_control_fields(self):
+        response = self.client.get('/control_details/', {'fields': 'name'})
+        self.assertEqual(response.json()['results'], [{'name': 'Alpha'}, {'name': 'Beta'}, {'name': 'Gamma'}])
+        self.assertEqual(self.client.get('/control_details/', {'name': 'Beta', 'fields': 'description'}).json(), {'description': 'Beta desc'})
+
+    def test_hierarchy_fields_and_expand(self):
+        response = self.client.get('/controlhierarchies_details/', {'name': 'Leaf', 'fields': 'control_set_name,parents'})
+        self.assertEqual(response.json(), {'parents': ['Mid', 'Other'], 'control_set_name': 'Leaf'})
+        response = self.client.get('/controlhierarchies_details/', {'name': 'Leaf', 'fields': 'control_set'})
+        self.assertEqual(response.json(), {'control_set': [{'name': 'Gamma', 'reference_id': 'G1'}]})
+        response = self.client.get('/controlhierarchies_details/', {'name': 'Leaf', 'fields': 'control_set', 'expand': 'control_set'})
+        self.assertEqual(response.json()['control_set'][0]['description'], 'Gamma desc')
+
+    def test_unrequested_fields_are_not_queried(self):
+        with CaptureQueriesContext(connection) as full:
+            self.client.get('/controlhierarchies_details/')
+        with CaptureQueriesContext(connection) as sparse:
+            response = self.client.get('/controlhierarchies_details/', {'fields': 'slug'})
+        self.assertEqual(len(response.json()['results']), 4)
+        self.assertLess(len(sparse.captured_queries), len(full.captured_queries))
+        self.assertFalse(any('controlsapi_hierarchyedge' in query['sql'] for query in sparse.captured_queries))
+
+    def test_rejects_unknown_fields(self):
+        self.assertEqual(self.client.get('/control_details/', {'fields': 'name,secret'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/controlhierarchies_details/', {'expand': 'parents'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CompressionTests(APITestCase):
+    def setUp(self):
+        self.client.post('/control_bulk_create/', [{'name': 'Control ' + 'abcdefghijklmnopqrst'[index], 'description': 'x' * 200} for index in range(20)], format='json')
+        self.plain = self.client.get('/control_details/').content
+
+    def test_prefers_brotli(self):
+        response = self.client.get('/control_details/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), self.plain)
+
+    def test_falls_back_to_gzip_without_brotli(self):
+        with mock.patch('controlsAPI.middleware.brotli', None):
+            response = self.client.get('/control_details/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.plain)
+
+    def test_follows_accept_encoding(self):
+        self.assertEqual(self.client.get('/control_details/', HTTP_ACCEPT_ENCODING='br;q=0, gzip')['Content-Encoding'], 'gzip')
+        self.assertFalse(self.client.get('/control_details/', HTTP_ACCEPT_ENCODING='identity').has_header('Content-Encoding'))
+        self.assertFalse(self.client.get('/control_details/', {'page_size': 1}, HTTP_ACCEPT_ENCODING='gzip').has_header('Content-Encoding'))
+        self.assertEqual(choose_encoding('*', streaming=True), 'gzip')
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    def test_matches_json_renderer(self):
+        for data in ({'name': 'a\u2028b\u2029c', 'count': 3, 'nested': [None, True, 'é']}, {'wide': 2 ** 70}, [1, 'two'], {1: 'non-string key'}):
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+# Transaction test case: the index applies this process's writes once they are committed.
+class ControlSearchIndexTests(APITransactionTestCase):
+    def setUp(self):
+        for name, description in (('Access', 'grant user access'), ('Audit', 'review user logs')):
+            self.client.post('/control_create/', {'name': name, 'description': description}, format='json')
+        control_search_index.build()
+
+    def search(self, **params):
+        return [item['name'] for item in self.client.get('/control_search/', params).json()['results']]
+
+    def test_applies_own_writes_without_rebuilding(self):
+        with mock.patch.object(control_search_index, 'build', wraps=control_search_index.build) as build:
+            self.client.post('/control_create/', {'name': 'Backup', 'description': 'copy user data'}, format='json')
+            self.client.put('/control_update/', {'name': 'Audit', 'description': 'review system logs'}, format='json')
+            self.client.delete('/control_delete/', {'name': 'Access'}, format='json')
+            self.assertEqual(self.search(prefix='a'), ['Audit'])
+            self.assertEqual(self.search(q='user'), ['Backup'])
+            self.assertEqual(self.search(q='logs', prefix='au'), ['Audit'])
+            build.assert_not_called()
+
+    # Rows changed behind the signals with the version bumped stand in for a write of another worker.
+    def test_rebuilds_when_another_worker_writes(self):
+        Control.objects.filter(name='Audit').update(description='review system logs')
+        bump_versions('control')
+        with mock.patch.object(control_search_index, 'build', wraps=control_search_index.build) as build:
+            self.assertEqual(self.search(q='user'), ['Access'])
+            self.client.post('/control_create/', {'name': 'Backup', 'description': 'copy user data'}, format='json')
+            self.assertEqual(sorted(self.search(q='user')), ['Access', 'Backup'])
+            self.assertEqual(build.call_count, 1)
+
+class ControlSetSubtreeTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+
+    def test_resolves_nested_tree(self):
+        tree = self.client.get('/controlset_subtree/', {'name': 'Root'}).json()
+        self.assertEqual(tree['control_set_name'], 'Root')
+        self.assertEqual([node['control_set_name'] for node in tree['subtree']], ['Mid', 'Other'])
+        for node in tree['subtree']:
+            self.assertEqual(node['parents'], ['Root'])
+            self.assertEqual([(leaf['control_set_name'], leaf['subtree']) for leaf in node['subtree']], [('Leaf', [])])
+
+    # Nodes on the last level only show their children were not loaded.
+    def test_depth_limits_levels(self):
+        tree = self.client.get('/controlset_subtree/', {'name': 'Root', 'depth': 1}).json()
+        self.assertEqual([(node['control_set_name'], node['subtree']) for node in tree['subtree']], [('Mid', None), ('Other', None)])
+        self.assertIsNone(self.client.get('/controlset_subtree/', {'name': 'Root', 'depth': 0}).json()['subtree'])
+        self.assertEqual(self.client.get('/controlset_subtree/', {'name': 'Leaf', 'depth': 0}).json()['subtree'], [])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get('/controlset_subtree/').status_code, status.HTTP_400_BAD_REQUEST)
+        for depth in ('two', -1, SUBTREE_MAX_DEPTH + 1):
+            self.assertEqual(self.client.get('/controlset_subtree/', {'name': 'Root', 'depth': depth}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/controlset_subtree/', {'name': 'Missing'}).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class EffectiveControlsTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+        self.slugs = dict(ControlSet.objects.values_list('name', 'slug'))
+        for name, reference in (('Leaf', 'Alpha'), ('Mid', 'Beta'), ('Other', 'Gamma')):
+            ControlHierarchy.objects.get(slug=self.slugs[name]).control_set.add(reference)
+        for slug in self.slugs.values():
+            effective_reference_names(slug)
+
+    def memos(self):
+        names = {slug: name for name, slug in self.slugs.items()}
+        return sorted(names[slug] for slug in EffectiveControls.objects.values_list('slug', flat=True))
+
+    def test_inherits_from_descendants(self):
+        response = self.client.get('/controlset_effective_controls/', {'name': 'Root'})
+        self.assertEqual([item['name'] for item in response.json()['effective_controls']], ['Alpha', 'Beta', 'Gamma'])
+        self.assertEqual(effective_reference_names(self.slugs['Mid']), ['Alpha', 'Beta'])
+
+    def test_control_set_delete_drops_its_ancestors_only(self):
+        self.client.delete('/controlset_delete/', {'name': 'Mid'}, format='json')
+        self.assertEqual(self.memos(), ['Leaf', 'Other'])
+        self.assertEqual(effective_reference_names(self.slugs['Root']), ['Alpha', 'Gamma'])
+
+    def test_reference_delete_drops_holders_and_ancestors_only(self):
+        ControlSetReference.objects.get(name='Gamma').delete()
+        self.assertEqual(self.memos(), ['Leaf', 'Mid'])
+        self.assertEqual(effective_reference_names(self.slugs['Root']), ['Alpha', 'Beta'])
+        self.client.delete('/control_delete/', {'name': 'Beta'}, format='json')
+        self.assertEqual(self.memos(), ['Leaf'])
+        self.assertEqual(effective_reference_names(self.slugs['Root']), ['Alpha'])
+
+
+class CoverageTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+        slugs = dict(ControlSet.objects.values_list('name', 'slug'))
+        for name, references in (('Root', ['Alpha', 'Beta']), ('Mid', ['Beta', 'Gamma']), ('Leaf', ['Gamma'])):
+            ControlHierarchy.objects.get(slug=slugs[name]).control_set.add(*references)
+
+    def compare(self, op, names):
+        return self.client.get('/controlset_compare/', {'op': op, 'names': names})
+
+    def test_compare(self):
+        self.assertEqual(self.compare('union', 'Root,Mid').json()['references'], ['Alpha', 'Beta', 'Gamma'])
+        self.assertEqual(self.compare('intersection', 'Root,Mid').json()['references'], ['Beta'])
+        self.assertEqual(self.compare('difference', 'Mid,Root,Leaf').json()['references'], [])
+        self.assertEqual(self.compare('difference', 'Root,Mid').json()['references'], ['Alpha'])
+
+    def test_overlap(self):
+        response = self.client.get('/controlset_overlap/', {'names': 'Root,Mid,Other'})
+        self.assertEqual(response.json()['shared'], [[2, 1, 0], [1, 2, 0], [0, 0, 0]])
+        self.assertEqual(self.client.get('/controlset_overlap/').json()['names'], ['Leaf', 'Mid', 'Other', 'Root'])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.compare('xor', 'Root,Mid').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.compare('union', 'Root').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.compare('union', 'Root,Missing').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/controlset_overlap/', {'names': 'Missing'}).status_code, status.HTTP_404_NOT_FOUND)
+
+    # An index built earlier stands in for the one of another worker.
+    def test_rebuilds_when_another_worker_writes(self):
+        index = CoverageIndex()
+        self.assertEqual(index.combine('intersection', ['Root', 'Mid']), ['Beta'])
+        slugs = dict(ControlSet.objects.values_list('name', 'slug'))
+        ControlHierarchy.objects.get(slug=slugs['Root']).control_set.add('Gamma')
+        self.assertEqual(index.combine('intersection', ['Root', 'Mid']), ['Beta', 'Gamma'])
+
+
+class ChangesTests(APITestCase):
+    def setUp(self):
+        self.client.post('/control_create/', {'name': 'Alpha', 'description': 'first'}, format='json')
+        self.client.post('/control_create/', {'name': 'Beta', 'description': 'second'}, format='json')
+        self.since = latest_sequence()
+
+    def changes(self, **params):
+        return self.client.get('/changes/', params).json()
+
+    def test_upserts_and_tombstones(self):
+        self.client.put('/control_update/', {'name': 'Alpha', 'description': 'updated'}, format='json')
+        self.client.delete('/control_delete/', {'name': 'Beta'}, format='json')
+        data = self.changes(since=self.since)
+        self.assertEqual(data['upserts']['control'], [{'name': 'Alpha', 'description': 'updated'}])
+        self.assertEqual(data['tombstones']['control'], ['Beta'])
+        self.assertIn('Beta', data['tombstones']['controlsetreference'])
+        self.assertEqual(data['next_since'], latest_sequence())
+        self.assertFalse(data['has_more'])
+        data = self.changes(since=data['next_since'])
+        self.assertEqual((data['upserts'], data['next_since']), ({}, latest_sequence()))
+
+    def test_pages(self):
+        first, second = ChangeLogEntry.objects.order_by('sequence').values_list('sequence', flat=True)[:2]
+        data = self.changes(since=first - 1, page_size=1)
+        self.assertEqual((data['next_since'], data['has_more']), (first, True))
+        data = self.changes(since=data['next_since'], page_size=1)
+        self.assertEqual((data['next_since'], data['has_more']), (second, True))
+        data = self.changes(since=self.since - 1, page_size=1)
+        self.assertEqual((data['next_since'], data['has_more']), (self.since, False))
+
+    # A missing sequence may belong to a transaction that has not committed yet.
+    def test_stops_before_open_gap(self):
+        entry = ChangeLogEntry.objects.create(sequence=self.since + 2, collection='control', key='Alpha')
+        data = self.changes(since=self.since)
+        self.assertEqual((data['next_since'], data['upserts']), (self.since, {}))
+        ChangeLogEntry.objects.filter(pk=entry.pk).update(changed_at=timezone.now() - CHANGES_GAP_TIMEOUT - timedelta(seconds=1))
+        data = self.changes(since=self.since)
+        self.assertEqual(data['next_since'], self.since + 2)
+        self.assertEqual(data['upserts']['control'], [{'name': 'Alpha', 'description': 'first'}])
+
+    def test_invalid_requests(self):
+        for params in ({'since': 'x'}, {'since': -1}, {'page_size': 0}, {'page_size': 'x'}):
+            self.assertEqual(self.client.get('/changes/', params).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CatalogSnapshotTests(APITestCase):
+    def setUp(self):
+        seed_catalog(self.client)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(CONTROLS_API_SNAPSHOT_PATH=os.path.join(directory.name, 'catalog.snapshot'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        build_snapshot()
+
+    def get(self, encoding='identity', **headers):
+        response = self.client.get('/catalog_snapshot/', HTTP_ACCEPT_ENCODING=encoding, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def live(self):
+        return json.loads(JSONRenderer().render(hierarchy_data(list(ControlHierarchy.objects.prefetch_related('control_set').order_by('slug')))))
+
+    def test_serves_snapshot_until_a_write(self):
+        response, body = self.get()
+        self.assertEqual(response['X-Catalog-Source'], 'snapshot')
+        self.assertTrue(response.streaming)
+        self.assertEqual(json.loads(body), self.live())
+        response = self.client.get('/catalog_snapshot/', {'name': 'Leaf'})
+        self.assertEqual((response['X-Catalog-Source'], response.json()['control_set_name']), ('snapshot', 'Leaf'))
+        self.client.put('/controlhierarchies_update/', {'name': 'Leaf', 'parents': ['Root']}, format='json')
+        response, body = self.get()
+        self.assertEqual(response['X-Catalog-Source'], 'live')
+        self.assertEqual(json.loads(body), self.live())
+
+    # Sequences are handed out on insert, so a lower one can be committed after the snapshot was built.
+    def test_late_commit_of_lower_sequence_makes_it_stale(self):
+        sequence = ChangeLogEntry.objects.order_by('-sequence').values_list('sequence', flat=True)[0]
+        ChangeLogEntry.objects.create(sequence=sequence + 2, collection='controlset', key='late')
+        build_snapshot()
+        self.assertEqual(self.get()[0]['X-Catalog-Source'], 'snapshot')
+        ChangeLogEntry.objects.create(sequence=sequence + 1, collection='controlset', key='late')
+        self.assertEqual(self.get()[0]['X-Catalog-Source'], 'live')
+
+    def test_compresses_once_per_snapshot(self):
+        with mock.patch('controlsAPI.snapshot.compress', wraps=compress) as compressed:
+            for _ in range(2):
+                response, body = self.get('gzip')
+                self.assertEqual(response['Content-Encoding'], 'gzip')
+                self.assertEqual(json.loads(gzip.decompress(body)), self.live())
+        compressed.assert_called_once()
+
+    def test_byte_ranges(self):
+        full = self.get()[1]
+        response, body = self.get('gzip', HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual((body, response['Content-Range']), (full[:10], f"bytes 0-9/{len(full)}"))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(self.get(HTTP_RANGE='bytes=-5')[1], full[-5:])
+        response = self.client.get('/catalog_snapshot/', HTTP_RANGE=f"bytes={len(full)}-")
+        self.assertEqual((response.status_code, response['Content-Range']), (status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, f"bytes */{len(full)}"))
@@ -0,0 +1,44 @@
+from .fieldsets import hierarchy_data, hierarchy_queryset
+from .models import ControlSet, HierarchyEdge
+
+SUBTREE_DEFAULT_DEPTH = 3
+SUBTREE_MAX_DEPTH = 10
+
+
+# Breadth-first walk down the edges from root, one HierarchyEdge query per level.
+# Returns {name: [child names]} for every control set reached above max_depth.
+def _walk_levels(root, max_depth):
+    children = {}
+    frontier = [root]
+    for _ in range(max_depth):
+        if not frontier:
+            break
+        for name in frontier:
+            children[name] = []
+        for parent, child in HierarchyEdge.objects.filter(parent_id__in=frontier).order_by('id').values_list('parent_id', 'child_id'):
+            children[parent].append(child)
+        frontier = list(dict.fromkeys(child for name in frontier for child in children[name] if child not in children))
+    for name in frontier:
+        children.setdefault(name, None)
+    return children
+
+
+# Resolve the control set called root and everything below it down to max_depth levels as a nested
+# tree. Every node is resolved like controlhierarchies_details/?name=..., all in a fixed number of
+# queries after the walk. Nodes on the last level have "subtree": null when they have children
+# that were not loaded.
+def subtree(root, max_depth=SUBTREE_DEFAULT_DEPTH):
+    children = _walk_levels(root, max_depth)
+    slugs = dict(ControlSet.objects.filter(name__in=list(children)).values_list('name', 'slug'))
+    hierarchies = list(hierarchy_queryset(None).filter(slug__in=[str(slug) for slug in slugs.values()]))
+    nodes = {data['control_set_name']: data for data in hierarchy_data(hierarchies)}
+
+    def build(name):
+        node = dict(nodes.get(name, {'control_set_name': name}))
+        if children.get(name) is not None:
+            node['subtree'] = [build(child) for child in children[name]]
+        else:
+            node['subtree'] = [] if not node.get('children') else None
+        return node
+
+    return build(root)
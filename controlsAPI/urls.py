@@ -1,19 +1,39 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path("control_create/", views.ControlCreateAPI.as_view()),
+    path("control_bulk_create/", views.ControlBulkCreateAPI.as_view()),
     path("control_delete/", views.ControlDeleteAPI.as_view()),
     path("control_details/", views.AllControlDetailsAPI.as_view()),
+    path("control_search/", views.ControlSearchAPI.as_view()),
     path("control_update/", views.ControlUpdateAPI.as_view()),
     path("controlsetreference_update/", views.ControlsetRefUpdateAPI.as_view()),
+    path("controlsetreference_bulk_update/", views.ControlsetRefBulkUpdateAPI.as_view()),
     path("controlsetreference_details/", views.AllControlsetRefDetailsAPI.as_view()),
     path("controlset_create/", views.ControlSetCreateAPI.as_view()),
+    path("controlset_bulk_create/", views.ControlSetBulkCreateAPI.as_view()),
     path("controlset_update/", views.ControlSetUpdateAPI.as_view()),
     path("controlset_delete/", views.ControlSetDeleteAPI.as_view()),
     path("controlset_details/", views.AllControlSetDetailsAPI.as_view()),
     path("controlhierarchies_update/", views.ControlHierarchyUpdateAPI.as_view()),
     path("controlhierarchies_details/",views.AllControlHierarchiesDetailsAPI.as_view()),
-    path("controlhierarchies_controlsetdelete/", views.ControlHierarchyControlsetDeleteAPI.as_view())
+    path("controlhierarchies_controlsetdelete/", views.ControlHierarchyControlsetDeleteAPI.as_view()),
+    path("catalog_export/", views.CatalogExportAPI.as_view()),
+    path("catalog_snapshot/", views.CatalogSnapshotAPI.as_view()),
+    path("controlset_ancestors/", views.ControlSetAncestorsAPI.as_view()),
+    path("controlset_descendants/", views.ControlSetDescendantsAPI.as_view()),
+    path("controlset_subtree/", views.ControlSetSubtreeAPI.as_view()),
+    path("controlset_effective_controls/", views.ControlSetEffectiveControlsAPI.as_view()),
+    path("controlset_compare/", views.ControlSetCompareAPI.as_view()),
+    path("controlset_overlap/", views.ControlSetOverlapAPI.as_view()),
+    path("controlset_path/", views.ControlSetPathAPI.as_view()),
+    path("changes/", views.ChangesAPI.as_view()),
+    path("cache_stats/", views.CacheStatsAPI.as_view()),
+    path("batch/", views.BatchAPI.as_view()),
+    path("async/control_details/", async_views.AsyncControlDetailsView.as_view()),
+    path("async/controlsetreference_details/", async_views.AsyncControlsetRefDetailsView.as_view()),
+    path("async/controlset_details/", async_views.AsyncControlSetDetailsView.as_view()),
+    path("async/controlhierarchies_details/", async_views.AsyncControlHierarchiesDetailsView.as_view()),
     
 ]
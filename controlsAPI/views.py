@@ -2,8 +2,30 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
 from .serializers import ControlHierarchyModelSerializer, ControlModelSerializer, ControlsetModelSerializer, ControlsetReferenceModelSerializer
-from .models import ControlHierarchy, ControlSet, Control, ControlSetReference
+from .models import ControlHierarchy, ControlSet, Control, ControlSetReference, HierarchyEdge
+from .fieldsets import CONTROL_FIELDS, HIERARCHY_EXPANDABLE, HIERARCHY_FIELDS, FieldsetError, fieldset_parameters, hierarchy_data, hierarchy_queryset, parse_fieldset, trim
+from .pagination import ControlHierarchyPagination, ControlPagination, ControlSetPagination, ControlSetReferencePagination, SearchPagination, pagination_parameters
+from .bulk import bulk_create_control_sets, bulk_create_controls
+from .export import EXPORT_CHUNK_SIZE, iter_ndjson
+from .graph import hierarchy_graph
+from .search import control_search_index
+from .tree import SUBTREE_DEFAULT_DEPTH, SUBTREE_MAX_DEPTH, subtree
+from .effective import effective_reference_names
+from .coverage import COVERAGE_OPERATIONS, coverage_index
+from .changelog import CHANGES_MAX_PAGE_SIZE, CHANGES_PAGE_SIZE, changes_since
+from .snapshot import byte_range, iter_slices, snapshot_store
+from .renderers import FastJSONRenderer
+from .middleware import choose_encoding
+from .resolvers import add_control_details
+from .closure import ancestor_slugs, remove_references
+from .cache import cache_stats, cached_response
+from .repository import get_repository
+from .references import change_reference_id, change_reference_ids
+from .cascade import delete_control
+from .batch import BatchError, run_batch
 from django.db import DatabaseError, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
@@ -24,12 +46,36 @@ class ControlCreateAPI(APIView):
             error_message = "Failed to create Control, Control name already exist"
             return Response({"error": error_message}, status=status.HTTP_400_BAD_REQUEST)
         
+class ControlBulkCreateAPI(APIView):
+    @swagger_auto_schema(
+        request_body=ControlModelSerializer(many=True),
+        responses={
+            201: "All Controls created",
+            207: "Some Controls created, the others are reported per index in 'errors'",
+            400: "No Control could be created"
+        }
+    )
+    def post(self, request):
+        if not isinstance(request.data, list):
+            return Response({"msg": "Expected a list of Controls"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            result = bulk_create_controls(request.data)
+        except DatabaseError as e:
+            error_message = "Failed to create Controls"
+            return Response({"error": error_message}, status=status.HTTP_400_BAD_REQUEST)
+        if not result["errors"]:
+            return Response(result, status=status.HTTP_201_CREATED)
+        if result["created"]:
+            return Response(result, status=status.HTTP_207_MULTI_STATUS)
+        return Response(result, status=status.HTTP_400_BAD_REQUEST)
+
 class ControlDeleteAPI(APIView):
     @swagger_auto_schema(
         request_body=openapi.Schema(
             type=openapi.TYPE_OBJECT,
             properties={
-                'name': openapi.Schema(type=openapi.TYPE_STRING, description='Name of the Control to delete')
+                'name': openapi.Schema(type=openapi.TYPE_STRING, description='Name of the Control to delete'),
+                'dry_run': openapi.Schema(type=openapi.TYPE_BOOLEAN, description='Only report the ControlSetReferences and ControlHierarchies that would be affected')
             },
             required=['name']
         ),
@@ -41,18 +87,16 @@ class ControlDeleteAPI(APIView):
     )
     def delete(self, request):
         name = request.data.get("name")
-        try:
-            control_obj = Control.objects.get(name=name)
-            control_set_ref_objs = ControlSetReference.objects.filter(name=control_obj.name)
-            control_set_ref_objs.delete()
-            control_hierarchies = ControlHierarchy.objects.filter(control_set__name=name)
-            for hierarchy in control_hierarchies:
-                hierarchy.control_set.remove(control_obj)
-            control_obj.delete()
-            control_hierarchies.delete()
-            return Response({"msg": "Control, ControlSetReferences, and ControlHierarchy components deleted successfully"})
-        except Control.DoesNotExist:
+        dry_run = request.data.get("dry_run", False)
+        if not isinstance(dry_run, bool):
+            return Response({"msg": "dry_run must be true or false"}, status=status.HTTP_400_BAD_REQUEST)
+        if not Control.objects.filter(name=name).exists():
             return Response({"msg": f"No Control found with name {name}"}, status=status.HTTP_404_NOT_FOUND)
+        # The hierarchies keep existing, they only lose the references to the deleted Control.
+        cascade = delete_control(name, dry_run=dry_run)
+        if dry_run:
+            return Response({"msg": "Dry run, nothing was deleted", "dry_run": True, **cascade})
+        return Response({"msg": "Control, ControlSetReferences, and ControlHierarchy components deleted successfully", **cascade})
 
 class AllControlDetailsAPI(APIView):
     @swagger_auto_schema(
@@ -64,7 +108,7 @@ class AllControlDetailsAPI(APIView):
                 type=openapi.TYPE_STRING,
                 required=False
             )
-        ],
+        ] + fieldset_parameters(CONTROL_FIELDS) + pagination_parameters,
         responses={
             200: openapi.Response('Successful retrieval of Control data', ControlModelSerializer(many=True)),
             404: openapi.Response('No object found with the specified name', openapi.Schema(
@@ -81,20 +125,76 @@ class AllControlDetailsAPI(APIView):
             ))
         }
     )
+    @cached_response('control_details', [Control])
     def get(self, request):
         name = request.query_params.get("name")
         # name = request.data.get("name")
+        try:
+            fields, expand = parse_fieldset(request, CONTROL_FIELDS)
+        except FieldsetError as e:
+            return Response({"msg": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         if name:
-            try:
-                control_obj = Control.objects.get(name=name)
-                control_serializer = ControlModelSerializer(control_obj)
-                return Response(control_serializer.data, status=status.HTTP_200_OK)
-            except Control.DoesNotExist:
+            control_data = get_repository().control(name)
+            if control_data is None:
                 return Response({"msg": f"No object found with name {name}"}, status=status.HTTP_404_NOT_FOUND)
+            return Response(trim(control_data, fields), status=status.HTTP_200_OK)
         else:
-            controls = Control.objects.all()
-            control_serializer = ControlModelSerializer(controls, many=True)
-            return Response(control_serializer.data, status=status.HTTP_200_OK)
+            paginator = ControlPagination()
+            queryset = Control.objects.all() if fields is None else Control.objects.only('name', *fields)
+            controls = paginator.paginate_queryset(queryset, request, view=self)
+            control_serializer = ControlModelSerializer(controls, many=True, fields=fields)
+            return paginator.get_paginated_response(control_serializer.data)
+
+class ControlSearchAPI(APIView):
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'prefix',
+                openapi.IN_QUERY,
+                description="Case-insensitive prefix of the Control name",
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            openapi.Parameter(
+                'q',
+                openapi.IN_QUERY,
+                description="Words that must all appear in the description, results are ranked by relevance",
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            openapi.Parameter(
+                'page',
+                openapi.IN_QUERY,
+                description="Page number of the ranked results",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+            openapi.Parameter(
+                'page_size',
+                openapi.IN_QUERY,
+                description="Number of results to return per page",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            )
+        ],
+        responses={
+            200: "Matching Controls, best match first",
+            400: "Invalid request data"
+        }
+    )
+    def get(self, request):
+        prefix = request.query_params.get("prefix", "")
+        query = request.query_params.get("q", "")
+        if not prefix and not query.strip():
+            return Response({"msg": "Either 'prefix' or 'q' is required"}, status=status.HTTP_400_BAD_REQUEST)
+        paginator = SearchPagination()
+        matches = paginator.paginate_queryset(control_search_index.search(query, prefix), request, view=self)
+        descriptions = dict(Control.objects.filter(name__in=[name for name, score in matches]).values_list('name', 'description'))
+        results = [
+            {"name": name, "description": descriptions[name], "score": round(score, 4)}
+            for name, score in matches if name in descriptions
+        ]
+        return paginator.get_paginated_response(results)
 
 class ControlUpdateAPI(APIView):
     @swagger_auto_schema(
@@ -161,20 +261,47 @@ class ControlsetRefUpdateAPI(APIView):
                 return Response({"msg": "The name field cannot be updated here. Name can only be updated in Control."}, status=status.HTTP_400_BAD_REQUEST)
             serializer = ControlsetReferenceModelSerializer(control_set_ref, data=request.data, partial=True)
             if serializer.is_valid():
-                old_reference_id = control_set_ref.reference_id
-                with transaction.atomic():
-                    serializer.save()
-                    control_hierarchies = ControlHierarchy.objects.filter(control_set=control_set_ref)
-                    for hierarchy in control_hierarchies:
-                        control_set = hierarchy.control_set.all()
-                        for cs_ref in control_set:
-                            if cs_ref.reference_id == old_reference_id:
-                                cs_ref.reference_id = new_reference_id
-                                cs_ref.save()
-                    return Response({"msg": "ControlSetReference and ControlHierarchy components updated successfully"}, status=status.HTTP_200_OK)
+                # Every reference that still carries the old id is rewritten by the same filtered update.
+                change_reference_id(control_set_ref, serializer.validated_data['reference_id'])
+                return Response({"msg": "ControlSetReference and ControlHierarchy components updated successfully"}, status=status.HTTP_200_OK)
             else:
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class ControlsetRefBulkUpdateAPI(APIView):
+    @swagger_auto_schema(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'mapping': openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    additional_properties=openapi.Schema(type=openapi.TYPE_STRING),
+                    description='Old reference id -> new reference id'
+                )
+            },
+            required=['mapping']
+        ),
+        responses={
+            200: "Number of ControlSetReferences moved to the new id, per old reference id",
+            400: "Invalid request data"
+        }
+    )
+    def put(self, request):
+        mapping = request.data.get("mapping") if isinstance(request.data, dict) else None
+        if not isinstance(mapping, dict) or not mapping:
+            return Response({"msg": "mapping must be a non-empty object of old reference_id -> new reference_id"}, status=status.HTTP_400_BAD_REQUEST)
+        invalid = [old_reference_id for old_reference_id, new_reference_id in mapping.items() if not isinstance(new_reference_id, str) or not new_reference_id]
+        if invalid:
+            return Response({"msg": f"New reference_id missing for {', '.join(invalid)}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            updated = change_reference_ids(mapping)
+        except DatabaseError as e:
+            error_message = "Failed to update ControlSetReferences, no reference_id was changed"
+            return Response({"error": error_message}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            "updated": updated,
+            "unknown": [old_reference_id for old_reference_id, count in updated.items() if not count]
+        }, status=status.HTTP_200_OK)
+
 class AllControlsetRefDetailsAPI(APIView):
     @swagger_auto_schema(
         manual_parameters=[
@@ -185,7 +312,7 @@ class AllControlsetRefDetailsAPI(APIView):
                 type=openapi.TYPE_STRING,
                 required=False
             )
-        ],
+        ] + pagination_parameters,
         responses={
             200: openapi.Response('Successful retrieval of data', ControlsetReferenceModelSerializer(many=True)),
             404: openapi.Response('No object found with the specified name', openapi.Schema(
@@ -202,20 +329,20 @@ class AllControlsetRefDetailsAPI(APIView):
             ))
         }
     )
+    @cached_response('controlsetreference_details', [ControlSetReference])
     def get(self, request):
         name = request.query_params.get("name")
         # name = request.data.get("name")
         if name:
-            try:
-                Control_set_ref_obj = ControlSetReference.objects.get(name=name)
-                controlsetref_serializer = ControlsetReferenceModelSerializer(Control_set_ref_obj)
-                return Response(controlsetref_serializer.data)
-            except ControlSetReference.DoesNotExist:
+            controlsetref_data = get_repository().reference(name)
+            if controlsetref_data is None:
                 return Response({"msg": f"No object found with name {name}"}, status=status.HTTP_404_NOT_FOUND)
+            return Response(controlsetref_data)
         else:
-            controlsetref = ControlSetReference.objects.all()
+            paginator = ControlSetReferencePagination()
+            controlsetref = paginator.paginate_queryset(ControlSetReference.objects.all(), request, view=self)
             controlsetref_serializer = ControlsetReferenceModelSerializer(controlsetref, many=True)
-            return Response(controlsetref_serializer.data)
+            return paginator.get_paginated_response(controlsetref_serializer.data)
 
 class ControlSetCreateAPI(APIView):
     @swagger_auto_schema(
@@ -233,6 +360,29 @@ class ControlSetCreateAPI(APIView):
             error_message = "Failed to create ControlSet"
             return Response({"error": error_message}, status=status.HTTP_400_BAD_REQUEST)
 
+class ControlSetBulkCreateAPI(APIView):
+    @swagger_auto_schema(
+        request_body=ControlsetModelSerializer(many=True),
+        responses={
+            201: "All ControlSets created",
+            207: "Some ControlSets created, the others are reported per index in 'errors'",
+            400: "No ControlSet could be created"
+        }
+    )
+    def post(self, request):
+        if not isinstance(request.data, list):
+            return Response({"msg": "Expected a list of ControlSets"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            result = bulk_create_control_sets(request.data)
+        except DatabaseError as e:
+            error_message = "Failed to create ControlSets"
+            return Response({"error": error_message}, status=status.HTTP_400_BAD_REQUEST)
+        if not result["errors"]:
+            return Response(result, status=status.HTTP_201_CREATED)
+        if result["created"]:
+            return Response(result, status=status.HTTP_207_MULTI_STATUS)
+        return Response(result, status=status.HTTP_400_BAD_REQUEST)
+
 class ControlSetUpdateAPI(APIView):
     @swagger_auto_schema(
             request_body=openapi.Schema(
@@ -280,14 +430,9 @@ class ControlSetDeleteAPI(APIView):
         name = request.data.get("name")
         try:
                 control_set_obj = ControlSet.objects.get(name=name)
-                control_hierarchy_objs = ControlHierarchy.objects.all()
-                for control_hierarchy_obj in control_hierarchy_objs:
-                    if control_set_obj.name in control_hierarchy_obj.parents:
-                        control_hierarchy_obj.parents.remove(control_set_obj.name)
-                    if control_set_obj.name in control_hierarchy_obj.children:
-                        control_hierarchy_obj.children.remove(control_set_obj.name)
-                    control_hierarchy_obj.save()
-                control_set_obj.delete()
+                # HierarchyEdge rows naming the ControlSet are removed with it (on_delete=CASCADE).
+                with transaction.atomic():
+                    control_set_obj.delete()
                 return Response({"msg": "ControlSet, ControlHierarchies deleted successfully"})
         except ControlSet.DoesNotExist:
             return Response({"msg": f"No ControlSet found with name {name}"}, status=status.HTTP_404_NOT_FOUND)
@@ -302,7 +447,7 @@ class AllControlSetDetailsAPI(APIView):
                 type=openapi.TYPE_STRING,
                 required=False
             )
-        ],
+        ] + pagination_parameters,
         responses={
             200: openapi.Response('Successful retrieval of data', ControlHierarchyModelSerializer(many=True)),
             404: openapi.Response('No object found with the specified name', openapi.Schema(
@@ -319,20 +464,20 @@ class AllControlSetDetailsAPI(APIView):
             ))
         }
     )
+    @cached_response('controlset_details', [ControlSet])
     def get(self, request):
         name = request.query_params.get("name")
         # name = request.data.get("name")
         if name:
-            try:
-                ControlSet_obj = ControlSet.objects.get(name=name)
-                controlset_serializer = ControlsetModelSerializer(ControlSet_obj)
-                return Response(controlset_serializer.data)
-            except ControlSet.DoesNotExist:
+            controlset_data = get_repository().control_set(name)
+            if controlset_data is None:
                 return Response({"msg": f"No object found with name {name}"}, status=status.HTTP_404_NOT_FOUND)
+            return Response(controlset_data)
         else:
-            controlset = ControlSet.objects.all()
+            paginator = ControlSetPagination()
+            controlset = paginator.paginate_queryset(ControlSet.objects.all(), request, view=self)
             controlset_serializer = ControlsetModelSerializer(controlset, many=True)
-            return Response(controlset_serializer.data)
+            return paginator.get_paginated_response(controlset_serializer.data)
 
 class ControlHierarchyUpdateAPI(APIView):
     @swagger_auto_schema(
@@ -384,7 +529,7 @@ class AllControlHierarchiesDetailsAPI(APIView):
                 type=openapi.TYPE_STRING,
                 required=False
             )
-        ],
+        ] + fieldset_parameters(HIERARCHY_FIELDS, HIERARCHY_EXPANDABLE) + pagination_parameters,
         responses={
             200: openapi.Response('Successful retrieval of data', ControlHierarchyModelSerializer(many=True)),
             404: openapi.Response('No object found with the specified name', openapi.Schema(
@@ -401,52 +546,35 @@ class AllControlHierarchiesDetailsAPI(APIView):
             ))
         }
     )
+    @cached_response('controlhierarchies_details', [ControlHierarchy, ControlSet, ControlSetReference, Control, HierarchyEdge])
     def get(self, request):
         name = request.query_params.get("name")
         # name = request.data.get("name")
-        def add_control_details(control_set_data):
-            for control_set_item in control_set_data:
-                reference_id = control_set_item.get('reference_id')
-                try:
-                    control_set_ref = ControlSetReference.objects.get(reference_id=reference_id)
-                    control_set_item['control_name'] = control_set_ref.name
-                    try:
-                        control = Control.objects.get(name=control_set_ref.name)
-                        control_set_item['description'] = control.description
-                    except Control.DoesNotExist:
-                        control_set_item['description'] = "Description not found"
-                except ControlSetReference.DoesNotExist:
-                    control_set_item['control_name'] = "Reference not found"
-                    control_set_item['description'] = "Description not found"
-        if name:
-            try:
-                create_set_obj = ControlSet.objects.get(name=name)
-                slug = create_set_obj.slug
-            except ControlSet.DoesNotExist:
+        try:
+            fields, expand = parse_fieldset(request, HIERARCHY_FIELDS, HIERARCHY_EXPANDABLE)
+        except FieldsetError as e:
+            return Response({"msg": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        full = fields is None and expand == set(HIERARCHY_EXPANDABLE)
+        if name and full:
+            control_set_data, response_data = get_repository().hierarchy_details(name)
+            if control_set_data is None:
                 return Response({"msg": f"No Control Set found with name {name}"}, status=status.HTTP_404_NOT_FOUND)
-            try:
-                controlhierarchy_obj = ControlHierarchy.objects.get(slug=slug)
-                controlhierarchy_serializer = ControlHierarchyModelSerializer(controlhierarchy_obj)
-                control_set_data = controlhierarchy_serializer.data.get('control_set', [])
-                add_control_details(control_set_data)
-                response_data = controlhierarchy_serializer.data
-                response_data['control_set_name'] = create_set_obj.name  
-                return Response(response_data)
-            except ControlHierarchy.DoesNotExist:
-                return Response({"msg": f"No ControlHierarchy found with slug {slug}"}, status=status.HTTP_404_NOT_FOUND)
+            if response_data is None:
+                return Response({"msg": f"No ControlHierarchy found with slug {control_set_data['slug']}"}, status=status.HTTP_404_NOT_FOUND)
+            return Response(response_data)
+        elif name:
+            control_set_data = get_repository().control_set(name)
+            if control_set_data is None:
+                return Response({"msg": f"No Control Set found with name {name}"}, status=status.HTTP_404_NOT_FOUND)
+            controlhierarchy_obj = hierarchy_queryset(fields).filter(slug=control_set_data['slug']).first()
+            if controlhierarchy_obj is None:
+                return Response({"msg": f"No ControlHierarchy found with slug {control_set_data['slug']}"}, status=status.HTTP_404_NOT_FOUND)
+            return Response(hierarchy_data([controlhierarchy_obj], fields, expand)[0])
         else:
-            controlhierarchy = ControlHierarchy.objects.all()
-            controlhierarchy_serializer = ControlHierarchyModelSerializer(controlhierarchy, many=True)
-            for control_hierarchy_data in controlhierarchy_serializer.data:
-                control_set_data = control_hierarchy_data.get('control_set', [])
-                add_control_details(control_set_data)
-                slug = control_hierarchy_data.get('slug')
-                try:
-                    create_set_obj = ControlSet.objects.get(slug=slug)
-                    control_hierarchy_data['control_set_name'] = create_set_obj.name  
-                except ControlSet.DoesNotExist:
-                    control_hierarchy_data['control_set_name'] = "Name not found"
-            return Response(controlhierarchy_serializer.data)
+            paginator = ControlHierarchyPagination()
+            controlhierarchy = paginator.paginate_queryset(hierarchy_queryset(fields), request, view=self)
+            response_data = hierarchy_data(controlhierarchy, fields, expand)
+            return paginator.get_paginated_response(response_data)
 
         
 class ControlHierarchyControlsetDeleteAPI(APIView):
@@ -483,17 +611,417 @@ class ControlHierarchyControlsetDeleteAPI(APIView):
             control_set_ref = ControlSetReference.objects.get(reference_id=reference_id)
         except ControlSetReference.DoesNotExist:
             return Response({"msg": f"No ControlSetReference found with reference_id {reference_id}"}, status=status.HTTP_404_NOT_FOUND)
-        control_hierarchy.control_set.remove(control_set_ref)
-        parents = control_hierarchy.parents
-        for parent_name in parents:
-            try:
-                parent_control_set = ControlSet.objects.get(name=parent_name)
-                parent_slug = parent_control_set.slug
-                parent_hierarchy = ControlHierarchy.objects.get(slug=parent_slug)
-                parent_hierarchy.control_set.remove(control_set_ref)
-            except ControlSet.DoesNotExist:
-                continue  
-            except ControlHierarchy.DoesNotExist:
-                continue 
-        return Response({"msg": "ControlSetReference deleted successfully from ControlHierarchy and its parents"}, status=status.HTTP_200_OK)
-    
\ No newline at end of file
+        remove_references([control_hierarchy.slug] + ancestor_slugs(control_hierarchy.slug), [control_set_ref])
+        return Response({"msg": "ControlSetReference deleted successfully from ControlHierarchy and its ancestors"}, status=status.HTTP_200_OK)
+
+class CatalogExportAPI(APIView):
+    # Streams its response, so it cannot be one of the operations of a /batch/ request.
+    batchable = False
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'chunk_size',
+                openapi.IN_QUERY,
+                description="Rows fetched from the database per batch",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            )
+        ],
+        responses={
+            200: "Newline-delimited JSON stream of the whole catalog",
+            400: "Invalid request data"
+        }
+    )
+    def get(self, request):
+        try:
+            chunk_size = int(request.query_params.get("chunk_size", EXPORT_CHUNK_SIZE))
+        except ValueError:
+            return Response({"msg": "chunk_size must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if chunk_size <= 0:
+            return Response({"msg": "chunk_size must be positive"}, status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(iter_ndjson(chunk_size), content_type="application/x-ndjson")
+        response['Content-Disposition'] = 'attachment; filename="catalog.ndjson"'
+        return response
+
+class CatalogSnapshotAPI(APIView):
+    batchable = False
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'name',
+                openapi.IN_QUERY,
+                description="Name of a Control set to return only its ControlHierarchy, the whole catalog when omitted",
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            openapi.Parameter(
+                'Range',
+                openapi.IN_HEADER,
+                description="Single byte range of the JSON body, e.g. bytes=0-65535",
+                type=openapi.TYPE_STRING,
+                required=False
+            )
+        ],
+        responses={
+            200: "Resolved ControlHierarchies as controlhierarchies_details returns them, read from the catalog snapshot while it is current",
+            206: "The requested byte range of the body",
+            404: "No Control set found with the specified name",
+            416: "The byte range is outside the body"
+        }
+    )
+    def get(self, request):
+        name = request.query_params.get("name")
+        slug = None
+        if name:
+            control_set_data = get_repository().control_set(name)
+            if control_set_data is None:
+                return Response({"msg": f"No Control Set found with name {name}"}, status=status.HTTP_404_NOT_FOUND)
+            slug = control_set_data['slug']
+        snapshot = snapshot_store.fresh()
+        if snapshot is not None:
+            source = "snapshot"
+            body = snapshot.hierarchy(slug) if name else snapshot.catalog()
+        else:
+            # No current snapshot: the same data is read with live queries.
+            source = "live"
+            hierarchies = ControlHierarchy.objects.prefetch_related('control_set').order_by('slug')
+            if name:
+                hierarchies = hierarchies.filter(slug=slug)
+            data = hierarchy_data(list(hierarchies))
+            body = None if name and not data else FastJSONRenderer().render(data[0] if name else data)
+        if body is None:
+            return Response({"msg": f"No ControlHierarchy found with slug {slug}"}, status=status.HTTP_404_NOT_FOUND)
+        length = len(body)
+        try:
+            selected = byte_range(request.META.get('HTTP_RANGE'), length)
+        except ValueError:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f"bytes */{length}"
+            return response
+        if selected is not None:
+            start, stop = selected
+            body = body[start:stop]
+        # The whole catalog is not copied into one bytes object for every request: it is compressed
+        # once per snapshot (so CompressionMiddleware leaves it alone), or streamed from the mapping.
+        whole_catalog = source == "snapshot" and not name
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', '')) if whole_catalog and selected is None else None
+        if encoding is not None:
+            response = HttpResponse(snapshot.compressed_catalog(encoding), content_type='application/json')
+            response['Content-Encoding'] = encoding
+            patch_vary_headers(response, ('Accept-Encoding',))
+        elif whole_catalog:
+            response = StreamingHttpResponse(iter_slices(body), content_type='application/json')
+            response['Content-Length'] = str(len(body))
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        if selected is not None:
+            response.status_code = status.HTTP_206_PARTIAL_CONTENT
+            response['Content-Range'] = f"bytes {start}-{stop - 1}/{length}"
+        response['Accept-Ranges'] = 'bytes'
+        response['X-Catalog-Source'] = source
+        return response
+
+class ControlSetAncestorsAPI(APIView):
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'name',
+                openapi.IN_QUERY,
+                description="Name of the Control set whose ancestors are returned",
+                type=openapi.TYPE_STRING,
+                required=True
+            )
+        ],
+        responses={
+            200: "Transitive ancestors of the Control set with their distance",
+            404: "No Control set found with the specified name",
+            400: "Invalid request data"
+        }
+    )
+    def get(self, request):
+        name = request.query_params.get("name")
+        if not name:
+            return Response({"msg": "Name is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if name not in hierarchy_graph:
+            return Response({"msg": f"No ControlSet found with name {name}"}, status=status.HTTP_404_NOT_FOUND)
+        ancestors = [{"name": ancestor, "distance": distance} for ancestor, distance in hierarchy_graph.ancestors(name)]
+        return Response({"name": name, "ancestors": ancestors})
+
+class ControlSetDescendantsAPI(APIView):
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'name',
+                openapi.IN_QUERY,
+                description="Name of the Control set whose descendants are returned",
+                type=openapi.TYPE_STRING,
+                required=True
+            )
+        ],
+        responses={
+            200: "Transitive descendants of the Control set with their distance",
+            404: "No Control set found with the specified name",
+            400: "Invalid request data"
+        }
+    )
+    def get(self, request):
+        name = request.query_params.get("name")
+        if not name:
+            return Response({"msg": "Name is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if name not in hierarchy_graph:
+            return Response({"msg": f"No ControlSet found with name {name}"}, status=status.HTTP_404_NOT_FOUND)
+        descendants = [{"name": descendant, "distance": distance} for descendant, distance in hierarchy_graph.descendants(name)]
+        return Response({"name": name, "descendants": descendants})
+
+class ControlSetSubtreeAPI(APIView):
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'name',
+                openapi.IN_QUERY,
+                description="Name of the Control set at the root of the tree",
+                type=openapi.TYPE_STRING,
+                required=True
+            ),
+            openapi.Parameter(
+                'depth',
+                openapi.IN_QUERY,
+                description=f"Number of levels below the root to include, {SUBTREE_DEFAULT_DEPTH} by default and at most {SUBTREE_MAX_DEPTH}",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            )
+        ],
+        responses={
+            200: "Nested tree of resolved ControlHierarchies under the Control set",
+            404: "No Control set found with the specified name",
+            400: "Invalid request data"
+        }
+    )
+    @cached_response('controlset_subtree', [ControlHierarchy, ControlSet, ControlSetReference, Control, HierarchyEdge])
+    def get(self, request):
+        name = request.query_params.get("name")
+        if not name:
+            return Response({"msg": "Name is required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            depth = int(request.query_params.get("depth", SUBTREE_DEFAULT_DEPTH))
+        except ValueError:
+            return Response({"msg": "depth must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 <= depth <= SUBTREE_MAX_DEPTH:
+            return Response({"msg": f"depth must be between 0 and {SUBTREE_MAX_DEPTH}"}, status=status.HTTP_400_BAD_REQUEST)
+        if not ControlSet.objects.filter(name=name).exists():
+            return Response({"msg": f"No ControlSet found with name {name}"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(subtree(name, depth))
+
+class ControlSetEffectiveControlsAPI(APIView):
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'name',
+                openapi.IN_QUERY,
+                description="Name of the Control set whose effective controls are returned",
+                type=openapi.TYPE_STRING,
+                required=True
+            )
+        ],
+        responses={
+            200: "ControlSetReferences held by the Control set or inherited from its descendants, with control details",
+            404: "No Control set found with the specified name",
+            400: "Invalid request data"
+        }
+    )
+    def get(self, request):
+        name = request.query_params.get("name")
+        if not name:
+            return Response({"msg": "Name is required"}, status=status.HTTP_400_BAD_REQUEST)
+        control_set_data = get_repository().control_set(name)
+        if control_set_data is None:
+            return Response({"msg": f"No ControlSet found with name {name}"}, status=status.HTTP_404_NOT_FOUND)
+        reference_names = effective_reference_names(control_set_data['slug'])
+        effective_controls = list(ControlSetReference.objects.filter(name__in=reference_names).order_by('name').values('name', 'reference_id'))
+        add_control_details(effective_controls)
+        return Response({"name": name, "slug": control_set_data['slug'], "count": len(effective_controls), "effective_controls": effective_controls})
+
+def _control_set_names(request):
+    return [name.strip() for name in request.query_params.get("names", "").split(',') if name.strip()]
+
+class ControlSetCompareAPI(APIView):
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'names',
+                openapi.IN_QUERY,
+                description="Comma-separated names of the Control sets to compare",
+                type=openapi.TYPE_STRING,
+                required=True
+            ),
+            openapi.Parameter(
+                'op',
+                openapi.IN_QUERY,
+                description="union, intersection, or difference (references of the first Control set missing from all others)",
+                type=openapi.TYPE_STRING,
+                enum=list(COVERAGE_OPERATIONS),
+                required=True
+            )
+        ],
+        responses={
+            200: "Names of the ControlSetReferences in the result",
+            404: "No Control set found with one of the specified names",
+            400: "Invalid request data"
+        }
+    )
+    def get(self, request):
+        names = _control_set_names(request)
+        operation = request.query_params.get("op")
+        if operation not in COVERAGE_OPERATIONS:
+            return Response({"msg": f"op must be one of {', '.join(COVERAGE_OPERATIONS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(names) < 2:
+            return Response({"msg": "At least two Control set names are required"}, status=status.HTTP_400_BAD_REQUEST)
+        missing = coverage_index.unknown(names)
+        if missing:
+            return Response({"msg": f"No ControlSet found with name {', '.join(missing)}"}, status=status.HTTP_404_NOT_FOUND)
+        references = coverage_index.combine(operation, names)
+        return Response({"op": operation, "names": names, "count": len(references), "references": references})
+
+class ControlSetOverlapAPI(APIView):
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'names',
+                openapi.IN_QUERY,
+                description="Comma-separated names of the Control sets to compare, all Control sets when omitted",
+                type=openapi.TYPE_STRING,
+                required=False
+            )
+        ],
+        responses={
+            200: "Matrix of the number of ControlSetReferences shared by each pair of Control sets",
+            404: "No Control set found with one of the specified names"
+        }
+    )
+    def get(self, request):
+        names = _control_set_names(request) or coverage_index.control_set_names()
+        missing = coverage_index.unknown(names)
+        if missing:
+            return Response({"msg": f"No ControlSet found with name {', '.join(missing)}"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"names": names, "shared": coverage_index.overlap_matrix(names)})
+
+class ControlSetPathAPI(APIView):
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'source',
+                openapi.IN_QUERY,
+                description="Name of the Control set the path starts from",
+                type=openapi.TYPE_STRING,
+                required=True
+            ),
+            openapi.Parameter(
+                'target',
+                openapi.IN_QUERY,
+                description="Name of the Control set the path ends at",
+                type=openapi.TYPE_STRING,
+                required=True
+            )
+        ],
+        responses={
+            200: "Shortest chain of Control sets from source to target",
+            404: "No Control set found with the specified name, or no path between them",
+            400: "Invalid request data"
+        }
+    )
+    def get(self, request):
+        source = request.query_params.get("source")
+        target = request.query_params.get("target")
+        if not source or not target:
+            return Response({"msg": "Both 'source' and 'target' are required"}, status=status.HTTP_400_BAD_REQUEST)
+        for name in (source, target):
+            if name not in hierarchy_graph:
+                return Response({"msg": f"No ControlSet found with name {name}"}, status=status.HTTP_404_NOT_FOUND)
+        path = hierarchy_graph.path(source, target)
+        if path is None:
+            return Response({"msg": f"No path found between {source} and {target}"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"source": source, "target": target, "path": path})
+
+class ChangesAPI(APIView):
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'since',
+                openapi.IN_QUERY,
+                description="Sequence number of the last change already applied, 0 for everything",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+            openapi.Parameter(
+                'page_size',
+                openapi.IN_QUERY,
+                description=f"Number of change log entries to read, {CHANGES_PAGE_SIZE} by default and at most {CHANGES_MAX_PAGE_SIZE}",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            )
+        ],
+        responses={
+            200: "Current state of the objects changed after 'since' and keys of the deleted ones, by collection. Request again with since=next_since while has_more is true. "
+                 "Changes logged after one that is not committed yet are held back until it is, so next_since never skips past it",
+            400: "Invalid request data"
+        }
+    )
+    def get(self, request):
+        try:
+            since = int(request.query_params.get("since", 0))
+            page_size = int(request.query_params.get("page_size", CHANGES_PAGE_SIZE))
+        except ValueError:
+            return Response({"msg": "since and page_size must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        if since < 0 or not 1 <= page_size <= CHANGES_MAX_PAGE_SIZE:
+            return Response({"msg": f"since must not be negative and page_size must be between 1 and {CHANGES_MAX_PAGE_SIZE}"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(changes_since(since, page_size))
+
+class CacheStatsAPI(APIView):
+    @swagger_auto_schema(
+        responses={
+            200: "Cache hits, misses and 304 responses per endpoint, counted by this process"
+        }
+    )
+    def get(self, request):
+        return Response(cache_stats.snapshot())
+
+class BatchAPI(APIView):
+    batchable = False
+
+    @swagger_auto_schema(
+        request_body=openapi.Schema(
+            type=openapi.TYPE_ARRAY,
+            items=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'method': openapi.Schema(type=openapi.TYPE_STRING, description='GET, POST, PUT, PATCH or DELETE'),
+                    'path': openapi.Schema(type=openapi.TYPE_STRING, description='Path of a controlsAPI endpoint, e.g. /control_create/'),
+                    'body': openapi.Schema(type=openapi.TYPE_OBJECT, description='Request body, or the query parameters of a GET')
+                },
+                required=['method', 'path']
+            )
+        ),
+        responses={
+            200: "Every operation succeeded and was committed, results are listed per operation",
+            400: "Invalid batch, or an operation failed. With atomic true the whole batch was rolled back; "
+                 "otherwise the database has no transactions and the first 'applied' operations stay applied"
+        }
+    )
+    def post(self, request):
+        try:
+            summary = run_batch(request, request.data)
+        except BatchError as e:
+            return Response({"msg": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except DatabaseError as e:
+            error_message = "Batch failed, no operation was committed"
+            return Response({"error": error_message}, status=status.HTTP_400_BAD_REQUEST)
+        if summary["committed"]:
+            return Response(summary, status=status.HTTP_200_OK)
+        failed = summary["results"][-1]["index"]
+        if summary["atomic"]:
+            summary["msg"] = f"Operation {failed} failed, the whole batch was rolled back"
+        else:
+            summary["msg"] = f"Operation {failed} failed. The database does not support transactions, so the operations before it were not rolled back"
+        return Response(summary, status=status.HTTP_400_BAD_REQUEST)